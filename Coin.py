@@ -1,5 +1,8 @@
 import config as cfg
-from utils import get_logger, read_timeseries
+from utils import get_logger, filename_timeseries
+from storage import get_store
+from gaps import get_gap_index
+from panel import get_panel
 import os
 import pandas as pd
 pd.set_option('display.max_columns', None)
@@ -20,37 +23,59 @@ class Coin:
 class CoinTimeSeries(Coin):
     """
     Holds time series (hence ts). Reads data from local disk, does not fetch from the server.
+
+    The data lives in the process-wide price panel: a product is loaded once per process, shared by all its
+    CoinTimeSeries, and refreshed only when the stored file changed.
     """
 
     def __init__(self, product="ETH-EUR"):
         super().__init__(product)
-        self._ts_filename = self.product + '.csv'
-        self._ts_filepath = os.path.join(cfg.PATH_DB_TIMESERIES, self._ts_filename)
-        self._raw_data = read_timeseries(product)
+        self._ts_filepath = filename_timeseries(product)
+        self._ts_filename = os.path.basename(self._ts_filepath)
+        self._store = get_store()
+        self._panel = get_panel()
+        self._series = None
+        self.update()
 
     def update(self):
-        self._raw_data = read_timeseries(self.product)
-        self._raw_data[self.denomination] = self._raw_data['close']
+        """Refreshes the shared data if the stored file has changed since the last call.
+        """
+        self._series = self._panel.get(self.product)
 
     @property
     def data(self):
         """DataFrame representing the fetched data stored locally.
         """
-        self.update()
-        return self._raw_data[self.denomination].to_frame()
+        return self.value.to_frame()
 
     @property
     def time(self):
         """Series representing time samples in epoch seconds.
         """
         self.update()
-        return pd.Series(self.data.index)
+        return pd.Series(self._series.epoch, copy=False)
 
     @property
     def value(self):
-        """ Value of the coin.
+        """ Value of the coin, a Series backed by a read-only view of the panel.
+        """
+        self.update()
+        return pd.Series(self._series.close, index=pd.Index(self._series.epoch, name='epoch'), name=self.denomination,
+                         copy=False)
+
+    @property
+    def volume(self):
+        """ Traded volume, a Series backed by a read-only view of the panel.
+        """
+        self.update()
+        return pd.Series(self._series.volume, index=pd.Index(self._series.epoch, name='epoch'), name='volume',
+                         copy=False)
+
+    @property
+    def gaps(self):
+        """List of (start, stop) epoch ranges of missing candles, from the gap index.
         """
-        return self.data[self.denomination]
+        return get_gap_index(self.product, store=self._store).query()
 
     @property
     def last_time_point(self):
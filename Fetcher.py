@@ -1,10 +1,16 @@
+import asyncio
 import datetime
+import logging
 import time
-import os
 import pandas as pd
-from utils import get_logger, round_now_to_minute, get_client, column_names, filename_timeseries, read_timeseries, product_list, \
-    parse_epoch
+from utils import get_logger, round_now_to_minute, get_client, column_names, filename_timeseries, product_list, \
+    parse_epoch, request_executor
+from storage import get_store
+from ratelimit import TokenBucket
+from backfill import BackfillPlanner
+from gaps import get_gap_index, windows as gap_windows
 import config as cfg
+import metrics
 from threading import Thread
 
 
@@ -13,65 +19,113 @@ class Fetcher:
         Fetches data from CB and saves to disk.
     """
 
-    def __init__(self, product_id='ETH-EUR', granularity=cfg.GRANULARITY):
+    def __init__(self, product_id='ETH-EUR', granularity=cfg.GRANULARITY, client=None, notify=None, limiter=None):
+        """
+        :param client: object implementing get_product_historic_rates, defaults to an authenticated cbpro client.
+        :param notify: callable(product_id, epoch) called after new candles are stored, e.g. Scheduler.notify.
+        :param limiter: `ratelimit.TokenBucket` gating the requests of `fetch_product`, shared by fetchers running in
+        parallel threads. Without it only backfills are limited, each to FETCH_RATE_LIMIT.
+        """
 
         self.logger = get_logger(product_id + '_' + self.__class__.__name__)
-        self.logger.info(f'Spawning a {product_id} Fetcher.')
+        self.logger.info("Spawning a %s Fetcher.", product_id)
         self.product_id = product_id
         self.granularity = granularity
         self.start_year = cfg.START_YEAR
-        self.auth_client = get_client()
+        self.auth_client = client or get_client()
+        self.store = get_store()
         self.filepath = filename_timeseries(self.product_id)
-        # create timeseries folder
-        if not os.path.exists(cfg.PATH_DB_TIMESERIES):
-            os.makedirs(cfg.PATH_DB_TIMESERIES)
         self.cycle = 0
+        self.cycle_rows = 0
+        self._gap_index = None
+        self.notify = notify
+        self.limiter = limiter
 
     @property
     def columns(self):
         return column_names()
 
-    def fetch_product(self):
-        # check if the csv is saved
-        # if not, make the first query
-        # if yes, load it and check the last timestamp and make a query to get the new data.
-        self.cycle += 1
-        self.logger.info(f"Starting cycle {self.cycle} for {self.product_id}========================")
-        time_now = round_now_to_minute(15)
-        # time_now = 1610535600
+    @property
+    def gap_index(self):
+        """
+        Gap index of the product, kept in sync with every append of this fetcher.
+        """
+        if self._gap_index is None:
+            self._gap_index = get_gap_index(self.product_id, self.granularity, self.store)
+        return self._gap_index
+
+    def append(self, df):
+        """
+        Appends new candles to the local db and updates the gap index.
+        """
+        gap_index = self.gap_index
+        self.store.append(self.product_id, df)
+        self.cycle_rows += df.shape[0]
+        metrics.counter('fetch_rows_appended_total', product=self.product_id).inc(df.shape[0])
+        valid = df['close'].notna().values
+        gap_index.update(df['epoch'].values, valid)
+        gap_index.save()
+        if self.notify is not None and valid.any():
+            self.notify(self.product_id, int(df['epoch'].values[valid].max()))
+
+    def to_frame(self, data):
+        """
+        Converts candles as returned by get_product_historic_rates to a df sorted by epoch, with a datetime column.
+        """
+        new_df = pd.DataFrame(data, columns=self.columns[:-1])
+        new_df[self.columns[-1]] = new_df['epoch'].apply(datetime.datetime.fromtimestamp, tz=datetime.timezone.utc)
+        new_df = new_df.sort_values(by='epoch', ascending=True)
+        new_df = new_df.drop_duplicates(subset='epoch', keep='last')
+        new_df.reset_index(drop=True, inplace=True)
+        return new_df
 
-        exists = os.path.isfile(self.filepath)
-        self.logger.info(f'{self.product_id}: Data will be stored in {self.filepath}.')
-        self.logger.info(f'{self.product_id}: Granularity is {self.granularity}.')
+    def _next_window(self):
+        """
+        Infers the next request window from the metadata of the local db, without reading the stored series.
+        :return: start and stop datetimes, whether the product exists locally and its `storage.ProductMeta`.
+        """
+        meta = self.store.meta(self.product_id)
+        exists = meta is not None and meta.last_epoch is not None
+        self.logger.info("%s: Data will be stored in %s.", self.product_id, self.filepath)
+        self.logger.info("%s: Granularity is %s.", self.product_id, self.granularity)
 
         # infer start time.
         start = datetime.datetime(self.start_year, 1, 1, 0, 0, 0)
-        current_rows = 0
         if exists:
-            old_df = read_timeseries(self.product_id)
-            current_rows = old_df.shape[0]
-            self.logger.info(f'Saved file found with {old_df.shape[0]} rows.')
-            # TODO: Take the index of the last non-None entry
-            last_stop = old_df.index.max()
+            self.logger.info("Saved file found with %s rows.", meta.rows)
+            # resume after the last stored row, placeholders included, not after meta.last_valid: the placeholder of
+            # an empty window (e.g. before the product was listed) is what moves the next request forward. Missing
+            # candles are refetched by repair_gaps.
+            last_stop = meta.last_epoch
             # Overwrite start point based on database.
             start = parse_epoch(last_stop + self.granularity - 1)  # wouldn't just +1 the same?
-            self.logger.info(f'{self.product_id}: Found {parse_epoch(last_stop)} as the '
-                             f'latest stored data point, will use {start.isoformat()} as starting point.')
+            self.logger.info("%s: Found %s as the latest stored data point, will use %s as starting point.",
+                             self.product_id, parse_epoch(last_stop), start.isoformat())
         else:
-            self.logger.info(f"{self.product_id}: Virgin call.")
+            self.logger.info("%s: Virgin call.", self.product_id)
         # find the stop time based on granularity. Only 300 data points fit to one request.
         stop = parse_epoch(start.timestamp() + self.granularity * 300)
+        return start, stop, exists, meta
 
-        self.logger.info(f'{self.product_id}: Getting historical data for with start: {start.isoformat()} stop:'
-                         f' {stop.isoformat()}.')
+    def _request(self, start, stop):
+        self.logger.info("%s: Getting historical data for with start: %s stop: %s.",
+                         self.product_id, start.isoformat(), stop.isoformat())
 
         # make the query with the start time
-        data = self.auth_client.get_product_historic_rates(product_id=self.product_id,
-                                                           start=start.isoformat(),
-                                                           end=stop.isoformat(),  # if end not provided than start is
-                                                           # ignored.
-                                                           granularity=self.granularity)
+        with metrics.timer('fetch_request_seconds'):
+            data = self.auth_client.get_product_historic_rates(product_id=self.product_id,
+                                                               start=start.isoformat(),
+                                                               end=stop.isoformat(),  # if end not provided than start
+                                                               # is ignored.
+                                                               granularity=self.granularity)
+        metrics.counter('fetch_requests_total', status='ok' if isinstance(data, list) else 'error').inc()
+        return data
 
+    def _save(self, data, start, stop, exists, meta, time_now):
+        """
+        Writes the response of a request to the local db.
+        :return: True if more data should be fetched.
+        """
         # data is contained in a list, errors in a dict.
         if isinstance(data, list):
 
@@ -83,46 +137,181 @@ class Fetcher:
                 # In case of 1, we need to hack it a bit so that we can still insert it in the
                 # csv file. Because the epoch data in csv file will be used for the next call and the next call
                 # should use the next time point.
-                self.logger.info(f"{self.product_id}: Data is an empty list, will use a list of Nones instead.")
+                self.logger.info("%s: Data is an empty list, will use a list of Nones instead.", self.product_id)
                 data = [int(stop.timestamp()), *[None] * (len(self.columns) - 2)]  # one column less.
                 data = [data]
                 # In case of 2, we should not write this empty row to disk if there were already records on the
                 # local db. Because empty data means also that we are asking data from future time points. In this
                 # case we should just quit the loop
                 if exists:
-                    if not old_df.isna().iloc[-1, 2]:
-                        self.logger.info(f"{self.product_id}: As the local file exists already we will not write this "
-                                         f"list of Nones to DB.")
-                        return
+                    if not meta.placeholder:
+                        self.logger.info("%s: As the local file exists already we will not write this list of Nones "
+                                         "to DB.", self.product_id)
+                        return False
 
-            new_df = pd.DataFrame(data, columns=self.columns[:-1])
-            # new_df.columns = column_names()[:-1]
-            new_df[self.columns[-1]] = new_df['epoch'].apply(datetime.datetime.fromtimestamp, tz=datetime.timezone.utc)
-            new_df = new_df.sort_values(by='epoch', ascending=True)
-            new_df.reset_index(drop=True, inplace=True)
+            new_df = self.to_frame(data)
 
             # merge old new
-            self.logger.info(f"{self.product_id}: Will add {new_df.shape[0]} new rows, was {current_rows}.")
-            self.logger.debug(f'{self.product_id}: New data starting point {new_df.iloc[0,-1]}')
-            self.logger.debug(f'{self.product_id}: New data stopping point {new_df.iloc[-1,-1]}')
+            current_rows = meta.rows if exists else 0
+            self.logger.info("%s: Will add %s new rows, was %s.", self.product_id, new_df.shape[0], current_rows)
+            debug = self.logger.isEnabledFor(logging.DEBUG)
+            if debug:
+                self.logger.debug("%s: New data starting point %s", self.product_id, new_df.iloc[0, -1])
+                self.logger.debug("%s: New data stopping point %s", self.product_id, new_df.iloc[-1, -1])
 
-            new_df.to_csv(self.filepath, mode='a', header=not exists, index=True)
+            self.append(new_df)
 
             # decide if we should continue getting historical date
-            self.logger.debug(f"{self.product_id}: START: {start.timestamp()} - END: {stop.timestamp()} ==> "
-                              f"{start.timestamp() - stop.timestamp()} checks {self.granularity * 300}")
-            self.logger.debug(f"{self.product_id}: LAST_DOWNLOADED_TIME: {new_df['epoch'].max()} - END:"
-                              f" {stop.timestamp()} ==> "
-                              f"{new_df['epoch'].max() - stop.timestamp()}")
-            self.logger.debug(f"{self.product_id}: TIME NOW: {int(time_now.timestamp())} - LAST_DOWNLOADED_TIME:"
-                              f" {new_df['epoch'].max()} "
-                              f"== > {int(time_now.timestamp()) - new_df['epoch'].max()} seconds to go...")
-            if time_now.timestamp() > new_df['epoch'].max():
-                self.logger.debug(f"Fetching more...")
-                self.fetch_product()
+            last = new_df['epoch'].max()
+            if debug:
+                self.logger.debug("%s: START: %s - END: %s ==> %s checks %s", self.product_id, start.timestamp(),
+                                  stop.timestamp(), start.timestamp() - stop.timestamp(), self.granularity * 300)
+                self.logger.debug("%s: LAST_DOWNLOADED_TIME: %s - END: %s ==> %s", self.product_id, last,
+                                  stop.timestamp(), last - stop.timestamp())
+                self.logger.debug("%s: TIME NOW: %s - LAST_DOWNLOADED_TIME: %s == > %s seconds to go...",
+                                  self.product_id, int(time_now.timestamp()), last, int(time_now.timestamp()) - last)
+            if time_now.timestamp() > last:
+                self.logger.debug("Fetching more...")
+                return True
+            return False
 
         else:
-            self.logger.error(f"Could not get historical data, instead got this:\n{data}")
+            self.logger.error("Could not get historical data, instead got this:\n%s", data)
+            return False
+
+    def fetch_product(self):
+        # check if the csv is saved
+        # if not, make the first query
+        # if yes, load it and check the last timestamp and make a query to get the new data.
+        self.cycle += 1
+        self.cycle_rows = 0
+        self.logger.info("Starting cycle %s for %s========================", self.cycle, self.product_id)
+        with metrics.timer('fetch_cycle_seconds', product=self.product_id):
+            time_now = round_now_to_minute(15)
+            # time_now = 1610535600
+            # long missing ranges are fetched with concurrent requests, the loop below picks up the rest.
+            planner = BackfillPlanner(self, until=time_now.timestamp())
+            windows = planner.plan()
+            more = True
+            if len(windows) > 1:
+                stats = planner.run_sync(limiter=self.limiter, windows=windows)
+                # a stopped backfill resumes from its checkpoint in the next cycle.
+                more = stats['windows'] == stats['planned']
+            while more:
+                start, stop, exists, meta = self._next_window()
+                if self.limiter is not None:
+                    self.limiter.wait()
+                data = self._request(start, stop)
+                more = self._save(data, start, stop, exists, meta, time_now)
+        metrics.histogram('fetch_cycle_rows', buckets=metrics.ROW_BUCKETS, product=self.product_id).observe(
+            self.cycle_rows)
+
+    async def _request_async(self, start, stop, limiter, semaphore, executor, timeout, retries, backoff):
+        """
+        Runs a blocking request in the executor, gated by the shared rate limiter and concurrency semaphore.
+        Timeouts, exceptions raised by the client (e.g. connection errors or undecodable responses) and error
+        responses are retried with exponential backoff.
+        :return: the response of the last attempt, None if the last attempt timed out or raised.
+        """
+        loop = asyncio.get_event_loop()
+        data = None
+        for attempt in range(retries + 1):
+            async with semaphore:
+                await limiter.acquire()
+                try:
+                    data = await asyncio.wait_for(loop.run_in_executor(executor, self._request, start, stop),
+                                                  timeout)
+                except asyncio.TimeoutError:
+                    self.logger.warning("%s: Request timed out after %s s (attempt %s).", self.product_id, timeout,
+                                        attempt + 1)
+                    data = None
+                except (OSError, ValueError) as e:
+                    # requests exceptions are OSErrors, responses that are not json raise ValueErrors.
+                    self.logger.warning("%s: Request failed with %r (attempt %s).", self.product_id, e, attempt + 1)
+                    data = None
+            if isinstance(data, list):
+                return data
+            if attempt < retries:
+                metrics.counter('fetch_retries_total').inc()
+                await asyncio.sleep(backoff * 2 ** attempt)
+        return data
+
+    async def fetch_product_async(self, limiter, semaphore, executor=None, timeout=cfg.FETCH_TIMEOUT,
+                                  retries=cfg.FETCH_RETRIES, backoff=cfg.FETCH_BACKOFF):
+        """
+        Asynchronous counterpart of fetch_product, used by FetcherArmy.run_async.
+        """
+        self.cycle += 1
+        self.cycle_rows = 0
+        self.logger.info("Starting async cycle %s for %s========================", self.cycle, self.product_id)
+        with metrics.timer('fetch_cycle_seconds', product=self.product_id):
+            time_now = round_now_to_minute(15)
+            loop = asyncio.get_event_loop()
+            planner = BackfillPlanner(self, until=time_now.timestamp())
+            windows = await loop.run_in_executor(executor, planner.plan)
+            more = True
+            if len(windows) > 1:
+                stats = await planner.run(limiter, semaphore, executor, timeout, retries, backoff, windows=windows)
+                # a stopped backfill resumes from its checkpoint in the next cycle.
+                more = stats['windows'] == stats['planned']
+            while more:
+                # disk i/o runs in the executor as well, so that it does not block the event loop.
+                start, stop, exists, meta = await loop.run_in_executor(executor, self._next_window)
+                data = await self._request_async(start, stop, limiter, semaphore, executor, timeout, retries,
+                                                 backoff)
+                if data is None:
+                    self.logger.error("%s: Giving up after %s attempts.", self.product_id, retries + 1)
+                    metrics.counter('fetch_failures_total', product=self.product_id).inc()
+                    break
+                more = await loop.run_in_executor(executor, self._save, data, start, stop, exists, meta, time_now)
+        metrics.histogram('fetch_cycle_rows', buckets=metrics.ROW_BUCKETS, product=self.product_id).observe(
+            self.cycle_rows)
+
+    def backfill(self, **kwargs):
+        """
+        Backfills the missing history with concurrent requests, resuming an interrupted backfill.
+        :return: backfill statistics, see BackfillPlanner.run.
+        """
+        return BackfillPlanner(self).run_sync(**kwargs)
+
+    def repair_gaps(self, concurrency=cfg.FETCH_CONCURRENCY, rate=cfg.FETCH_RATE_LIMIT, timeout=cfg.FETCH_TIMEOUT,
+                    retries=cfg.FETCH_RETRIES, backoff=cfg.FETCH_BACKOFF):
+        """
+        Refetches only the windows covering gaps of the gap index and inserts the candles into the local db.
+        Gaps the exchange has no data for remain in the index.
+        The repair rewrites the product, so registry features, bot features and crossover indices are recomputed from
+        the repaired candles on their next update.
+        :return: number of candles inserted.
+        """
+        todo = gap_windows(self.gap_index.gaps, self.granularity)
+        self.logger.info("%s: Repairing %s gaps (%s candles) with %s requests.",
+                         self.product_id, len(self.gap_index), self.gap_index.missing_candles, len(todo))
+        if not todo:
+            return 0
+
+        async def _fetch():
+            limiter, semaphore = TokenBucket(rate), asyncio.Semaphore(concurrency)
+            with request_executor(concurrency, 'repair') as executor:
+                return await asyncio.gather(*[self._request_async(parse_epoch(s), parse_epoch(e), limiter, semaphore,
+                                                                  executor, timeout, retries, backoff)
+                                              for s, e in todo])
+
+        frames = list()
+        for (s, e), data in zip(todo, asyncio.run(_fetch())):
+            if not isinstance(data, list):
+                self.logger.error("%s: Could not repair %s - %s: %s", self.product_id, parse_epoch(s), parse_epoch(e),
+                                  data)
+                continue
+            df = self.to_frame(data)
+            frames.append(df.loc[(df['epoch'] >= s) & (df['epoch'] <= e)])
+        new_df = pd.concat(frames) if frames else pd.DataFrame()
+        if not new_df.empty:
+            self.store.merge(self.product_id, new_df)
+        self._gap_index = self.gap_index.build()
+        self._gap_index.save()
+        self.logger.info("%s: Inserted %s candles, %s gaps left.", self.product_id, new_df.shape[0],
+                         len(self._gap_index))
+        return new_df.shape[0]
 
     def run(self):
         self.fetch_product()
@@ -131,22 +320,66 @@ class Fetcher:
 class FetcherArmy:
     """ Multi-thread orchestration of individual Fetchers."""
 
-    def __init__(self, ensemble: list):
+    def __init__(self, ensemble: list, client=None, notify=None):
         self.logger = get_logger("FetcherArmy...")
-        self.logger.info(f'Spawning a FetcherArmy with {len(ensemble)} fetchers.')
+        self.logger.info("Spawning a FetcherArmy with %s fetchers.", len(ensemble))
         self.army = list()
         for c in ensemble:
-            self.army.append(Fetcher(c))
+            self.army.append(Fetcher(c, client=client, notify=notify))
+
+    async def fetch_all_async(self, concurrency=cfg.FETCH_CONCURRENCY, rate=cfg.FETCH_RATE_LIMIT,
+                              timeout=cfg.FETCH_TIMEOUT, retries=cfg.FETCH_RETRIES, backoff=cfg.FETCH_BACKOFF):
+        """
+        Fetches all products concurrently. Requests of all fetchers share one token bucket limiting the request rate
+        and at most `concurrency` requests are in flight at any time.
+        """
+        limiter = TokenBucket(rate)
+        semaphore = asyncio.Semaphore(concurrency)
+        with metrics.timer('fetch_army_cycle_seconds'):
+            with request_executor(concurrency, 'fetch') as executor:
+                results = await asyncio.gather(*[soldier.fetch_product_async(limiter, semaphore, executor, timeout,
+                                                                             retries, backoff)
+                                                 for soldier in self.army], return_exceptions=True)
+        metrics.histogram('fetch_army_cycle_rows', buckets=metrics.ROW_BUCKETS).observe(
+            sum(soldier.cycle_rows for soldier in self.army))
+        for soldier, result in zip(self.army, results):
+            if isinstance(result, Exception):
+                self.logger.error("%s: Fetching failed with %r.", soldier.product_id, result)
+                metrics.counter('fetch_failures_total', product=soldier.product_id).inc()
+
+    def repair_gaps(self):
+        """
+        Repairs gaps of all products, serially.
+        :return: dict of product id to number of inserted candles.
+        """
+        return {soldier.product_id: soldier.repair_gaps() for soldier in self.army}
+
+    def run_async(self):
+        """
+        Asyncio fetcher runner, all products are fetched concurrently every cycle.
+        :return:
+        """
+        counter = 0
+        while True:
+            counter += 1
+            self.logger.info("Async Cycle Number %s.", counter)
+            start_time = time.time()
+            asyncio.run(self.fetch_all_async())
+            self.logger.info("Async Cycle Number %s took %.1f s.", counter, time.time() - start_time)
+            time.sleep(cfg.GRANULARITY)
 
     def run_threaded(self):
         """
-        Threaded fetcher runner.
+        Threaded fetcher runner. Requests of all threads share one token bucket limiting the request rate.
         :return:
         """
+        limiter = TokenBucket(cfg.FETCH_RATE_LIMIT)
+        for soldier in self.army:
+            soldier.limiter = limiter
         counter = 0
         while True:
             counter += 1
-            self.logger.info(f"Thread Cycle Number {counter}.")
+            self.logger.info("Thread Cycle Number %s.", counter)
             threads = [Thread(target=soldier.run, name=soldier.product_id) for soldier in self.army]
             for thread in threads:
                 thread.start()
@@ -163,14 +396,15 @@ class FetcherArmy:
         counter = 0
         while True:
             counter += 1
-            self.logger.info(f"Cycle Number {counter}.")
+            self.logger.info("Cycle Number %s.", counter)
             for soldier in self.army:
                 soldier.run()
             time.sleep(cfg.GRANULARITY)
 
 
 if __name__ == '__main__':
+    metrics.start('fetcher')
     products = product_list()
     army = FetcherArmy(products)
-    army.run()
+    army.run_async()
 
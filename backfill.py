@@ -0,0 +1,153 @@
+"""
+Parallel, resumable backfill of product histories.
+
+The missing range of a product is split up front into request windows of 300 candles, which are fetched concurrently
+and written out in order. Progress is checkpointed after every written window, so an interrupted backfill resumes
+where it stopped.
+"""
+import asyncio
+import datetime
+import json
+import os
+import time
+import numpy as np
+import config as cfg
+from ratelimit import TokenBucket
+from utils import round_now_to_minute, parse_epoch, request_executor
+
+# Coinbase returns at most 300 candles per request.
+CANDLES_PER_REQUEST = 300
+
+
+class BackfillPlanner:
+    """
+    Plans and runs the backfill of a single Fetcher's product.
+    """
+
+    def __init__(self, fetcher, until=None):
+        """
+        :param fetcher: Fetcher whose product, client, store and granularity are used.
+        :param until: last epoch to backfill, defaults to now.
+        """
+        self.fetcher = fetcher
+        self.logger = fetcher.logger
+        self.product_id = fetcher.product_id
+        self.granularity = fetcher.granularity
+        self.until = int(until or round_now_to_minute(15).timestamp())
+        self.checkpoint_filename = os.path.join(cfg.PATH_DB_CHECKPOINTS, self.product_id + '.json')
+        self._last_written = None
+        self._has_data = False
+
+    def load_checkpoint(self):
+        try:
+            with open(self.checkpoint_filename, 'r') as f:
+                checkpoint = json.load(f)
+        except FileNotFoundError:
+            return None
+        if checkpoint.get('granularity') != self.granularity:
+            return None
+        return checkpoint
+
+    def save_checkpoint(self, **fields):
+        os.makedirs(cfg.PATH_DB_CHECKPOINTS, exist_ok=True)
+        checkpoint = {'product_id': self.product_id, 'granularity': self.granularity, **fields}
+        tmp = self.checkpoint_filename + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp, self.checkpoint_filename)
+
+    def resume_point(self):
+        """
+        First epoch to fetch, from the stored data and the checkpoint, whichever is further.
+        """
+        meta = self.fetcher.store.meta(self.product_id)
+        resume = None
+        if meta is not None and meta.last_epoch is not None:
+            self._last_written = meta.last_epoch
+            self._has_data = meta.last_valid is not None
+            resume = self._last_written + self.granularity
+        checkpoint = self.load_checkpoint()
+        if resume is not None and checkpoint is not None and checkpoint.get('done_until') is not None:
+            done = checkpoint['done_until'] + self.granularity
+            resume = max(resume, done)
+        if resume is None:
+            resume = int(datetime.datetime(self.fetcher.start_year, 1, 1, 0, 0, 0).timestamp())
+        # align to the candle grid.
+        return -(-resume // self.granularity) * self.granularity
+
+    def plan(self):
+        """
+        Splits the missing range into request windows.
+        :return: list of (start, stop) epochs, both inclusive.
+        """
+        step = self.granularity * CANDLES_PER_REQUEST
+        first = self.resume_point()
+        return [(s, min(s + step - self.granularity, self.until)) for s in range(first, self.until + 1, step)]
+
+    def _write(self, start, stop, data):
+        """
+        Appends the candles of one window. Empty windows before the first real candle are recorded as a row of Nones,
+        so that the product is known to the store; empty windows after that are left as gaps.
+        :return: number of candles written.
+        """
+        df = self.fetcher.to_frame(data)
+        df = df.loc[(df['epoch'] >= start) & (df['epoch'] <= stop)]
+        if self._last_written is not None:
+            df = df.loc[df['epoch'] > self._last_written]
+        n = df.shape[0]
+        if df.empty and not self._has_data:
+            df = self.fetcher.to_frame([[stop, *[None] * (len(self.fetcher.columns) - 2)]])
+        if not df.empty:
+            self.fetcher.append(df)
+            self._last_written = int(df['epoch'].max())
+            self._has_data = self._has_data or n > 0
+        # the last window may still miss candles that are not ready yet, it is only done up to what was written.
+        done_until = stop if stop < self.until or self._last_written is None else min(stop, self._last_written)
+        self.save_checkpoint(done_until=done_until, until=self.until)
+        return n
+
+    async def run(self, limiter, semaphore, executor=None, timeout=cfg.FETCH_TIMEOUT, retries=cfg.FETCH_RETRIES,
+                  backoff=cfg.FETCH_BACKOFF, windows=None):
+        """
+        Fetches all planned windows concurrently through the shared limiter and writes them in order.
+        :param windows: windows returned by `plan`, planned here if not given.
+        :return: dict with the number of windows, candles and the throughput in candles per second.
+        """
+        loop = asyncio.get_event_loop()
+        if windows is None:
+            windows = await loop.run_in_executor(executor, self.plan)
+        self.logger.info("%s: Backfilling %s windows up to %s.", self.product_id, len(windows), parse_epoch(self.until))
+        start_time = time.time()
+        tasks = [asyncio.ensure_future(self.fetcher._request_async(parse_epoch(s), parse_epoch(e), limiter, semaphore,
+                                                                   executor, timeout, retries, backoff))
+                 for s, e in windows]
+        candles, done = 0, 0
+        try:
+            for (s, e), task in zip(windows, tasks):
+                data = await task
+                if not isinstance(data, list):
+                    self.logger.error("%s: Backfill stopped at %s, got %s. It will resume from there.",
+                                      self.product_id, parse_epoch(s), data)
+                    break
+                candles += await loop.run_in_executor(executor, self._write, s, e, data)
+                done += 1
+        finally:
+            for task in tasks:
+                task.cancel()
+        elapsed = time.time() - start_time
+        stats = {'windows': done, 'planned': len(windows), 'candles': candles, 'seconds': elapsed,
+                 'candles_per_second': candles / elapsed if elapsed > 0 else np.nan}
+        self.logger.info("%s: Backfilled %s candles in %s/%s windows, %.1f s, %.0f candles/s.",
+                         self.product_id, candles, done, len(windows), elapsed, stats['candles_per_second'])
+        return stats
+
+    def run_sync(self, concurrency=cfg.FETCH_CONCURRENCY, rate=cfg.FETCH_RATE_LIMIT, limiter=None, **kwargs):
+        """
+        Runs the backfill in its own event loop.
+        :param limiter: TokenBucket shared with backfills running in other threads, defaults to a new one limiting
+        this backfill to `rate` requests per second.
+        """
+        async def _run():
+            with request_executor(concurrency, 'backfill') as executor:
+                return await self.run(limiter or TokenBucket(rate), asyncio.Semaphore(concurrency), executor, **kwargs)
+        return asyncio.run(_run())
@@ -0,0 +1,34 @@
+"""
+Vectorized simulation of recommendation signals, shared by bot backtests and parameter sweeps.
+"""
+import numpy as np
+import pandas as pd
+
+
+def simulate(values, signal):
+    """
+    Simulates a long-only strategy: invested after a buy signal, out after a sell signal, unchanged otherwise.
+    :param values: prices, NaN for missing candles.
+    :param signal: 1 for buy, 0 for sell, NaN for no change, at every price.
+    :return: position, returns, strategy returns and equity arrays.
+    """
+    position = pd.Series(signal, dtype=float).ffill().fillna(0.).values
+    prices = pd.Series(values, dtype=float).ffill().values
+    returns = np.zeros(len(prices))
+    if len(prices) > 1:
+        returns[1:] = prices[1:] / prices[:-1] - 1
+    returns = np.nan_to_num(returns, nan=0., posinf=0., neginf=0.)
+    strategy = np.zeros(len(prices))
+    strategy[1:] = position[:-1] * returns[1:]
+    return position, returns, strategy, np.cumprod(1 + strategy)
+
+
+def summary(position, returns, equity) -> dict:
+    """
+    Strategy and buy and hold returns, number of trades and time in the market.
+    """
+    return {'strategy_return': equity[-1] - 1 if len(equity) else np.nan,
+            'hodl_return': np.prod(1 + returns) - 1,
+            'trades': int(np.abs(np.diff(position)).sum()),
+            'exposure': position.mean() if len(position) else np.nan,
+            'samples': len(position)}
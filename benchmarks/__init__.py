@@ -0,0 +1,14 @@
+"""
+Offline benchmarks of the main stages: reading timeseries, fetching, computing bot features and building the
+dashboard, and the import time of the entry points. They run on synthetic candles in a temporary local db and use a
+stub exchange client, so no Coinbase credentials are needed.
+
+Run from the repository root, e.g.
+
+    python -m benchmarks                    # all stages
+    python -m benchmarks.bench_read --products 20 --years 3
+    python -m benchmarks.bench_fetch --products 4 --years 1 --latency 0.05
+
+Every benchmark reports the minimum and median wall time over the repeats, and the peak Python memory of one extra
+traced run.
+"""
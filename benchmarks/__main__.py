@@ -0,0 +1,11 @@
+"""
+Runs all benchmarks with their default sizes, each in its own temporary db.
+"""
+from benchmarks import bench_read, bench_fetch, bench_features, bench_dashboard, bench_import
+from benchmarks.common import report
+
+if __name__ == '__main__':
+    results = list()
+    for bench in (bench_read, bench_fetch, bench_features, bench_dashboard, bench_import):
+        results += bench.run()
+    report(results)
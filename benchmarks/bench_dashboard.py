@@ -0,0 +1,35 @@
+"""
+Cost of building the dashboard panels: from scratch, and refreshing them when nothing changed.
+"""
+from benchmarks.common import configure, reset, measure, report, parser
+
+
+def run(products=10, years=2, repeat=3, db=None, render='vector'):
+    configure(db, RENDER_OPTION=render)
+    reset()
+    from storage import get_store
+    from benchmarks.synthetic import product_ids, populate
+    ids = product_ids(products)
+    rows = populate(ids, years, get_store())
+    from bots.Bot import MaBot
+    from history import get_writer
+    for p in ids:
+        MaBot(p, window_length=[90, 30]).update_rec()
+    get_writer().flush()
+    import visuals
+
+    dashboard = None
+
+    def cold():
+        nonlocal dashboard
+        dashboard = visuals.Dashboard()
+
+    info = dict(products=products, rows=rows, render=render)
+    return [measure("Dashboard.refresh[cold]", lambda: dashboard.refresh(), repeat, setup=cold, **info),
+            measure("Dashboard.refresh[unchanged]", lambda: dashboard.refresh(), repeat, **info)]
+
+
+if __name__ == '__main__':
+    p = parser(__doc__)
+    p.add_argument('--render', default='vector', choices=['vector', 'image'], help="panel rendering")
+    report(run(**vars(p.parse_args())))
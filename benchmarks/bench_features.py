@@ -0,0 +1,45 @@
+"""
+Cost of MaBot.feature_fun: from scratch, without new candles, and after one new candle.
+"""
+import shutil
+from benchmarks.common import configure, reset, measure, report, parser
+from benchmarks.synthetic import product_ids, populate, frame
+
+
+def run(products=10, years=2, repeat=3, db=None, window_length=(90, 30)):
+    configure(db)
+    reset()
+    import config as cfg
+    from storage import get_store
+    ids = product_ids(products)
+    rows = populate(ids, years, get_store())
+    from bots.Bot import MaBot
+
+    def cold():
+        shutil.rmtree(cfg.PATH_DB_FEATURE, ignore_errors=True)
+        reset()
+
+    def bots():
+        return [MaBot(p, window_length=list(window_length)) for p in ids]
+
+    def features(bots_):
+        return lambda: [b.feature_fun() for b in bots_]
+
+    def new_candle():
+        store = get_store()
+        for p in ids:
+            last = store.last_epoch(p)
+            store.append(p, frame(p, last + 1, last + cfg.GRANULARITY))
+
+    info = dict(products=products, rows=rows)
+    results = [measure("feature_fun[cold]", lambda: [b.feature_fun() for b in bots()], repeat, setup=cold, **info)]
+    warm = bots()
+    for b in warm:
+        b.feature_fun()
+    results.append(measure("feature_fun[no new candle]", features(warm), repeat, **info))
+    results.append(measure("feature_fun[one new candle]", features(warm), repeat, setup=new_candle, **info))
+    return results
+
+
+if __name__ == '__main__':
+    report(run(**vars(parser(__doc__).parse_args())))
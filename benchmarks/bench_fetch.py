@@ -0,0 +1,47 @@
+"""
+Cost of fetching candles from a local stub exchange: a full backfill and an up to date cycle, serially with
+Fetcher.fetch_product and concurrently with FetcherArmy.fetch_all_async.
+
+The stub answers without delay unless --latency is given, and the request rate limit is lifted unless --rate is
+given, so that the cost of the package itself is measured.
+"""
+import asyncio
+import datetime
+import shutil
+from benchmarks.common import configure, reset, measure, report, parser
+from benchmarks.stub import StubClient
+from benchmarks.synthetic import product_ids
+
+
+def run(products=4, years=1, repeat=1, db=None, latency=0., rate=1e6):
+    configure(db, START_YEAR=datetime.date.today().year - years, FETCH_RATE_LIMIT=rate)
+    reset()
+    import config as cfg
+    from Fetcher import Fetcher, FetcherArmy
+    ids = product_ids(products)
+    client = StubClient(ids, latency=latency)
+    candles = sum(len(client._series(p)) for p in ids)
+
+    def clear():
+        shutil.rmtree(cfg.PATH_DB, ignore_errors=True)
+        reset()
+
+    def fetch():
+        for p in ids:
+            Fetcher(p, client=client).fetch_product()
+
+    def fetch_async():
+        asyncio.run(FetcherArmy(ids, client=client).fetch_all_async())
+
+    info = dict(products=products, candles=candles, latency=latency)
+    return [measure("fetch_product[backfill]", fetch, repeat, setup=clear, **info),
+            measure("fetch_product[up to date]", fetch, repeat, **info),
+            measure("fetch_all_async[backfill]", fetch_async, repeat, setup=clear, **info),
+            measure("fetch_all_async[up to date]", fetch_async, repeat, **info)]
+
+
+if __name__ == '__main__':
+    p = parser(__doc__, products=4, years=1, repeat=1)
+    p.add_argument('--latency', type=float, default=0., help="seconds each stub request takes")
+    p.add_argument('--rate', type=float, default=1e6, help="request rate limit (requests per second)")
+    report(run(**vars(p.parse_args())))
@@ -0,0 +1,49 @@
+"""
+Import time of the entry points and the modules every process loads, each in a fresh interpreter, against a budget.
+"""
+import os
+import re
+import subprocess
+import sys
+from benchmarks.common import report, parser
+
+# budget in seconds of the cumulative import time of each module, as reported by `python -X importtime`.
+BUDGETS = {
+    'config': 0.005,
+    'utils': 0.05,
+    'metrics': 0.1,
+    'cli': 0.02,
+    'storage': 0.6,
+    'Fetcher': 0.8,
+    'bots.Bot': 0.8,
+    'visuals': 1.5,
+}
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_time(module):
+    """
+    Cumulative import time of module in a fresh interpreter, in seconds.
+    """
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], cwd=ROOT,
+                         capture_output=True, text=True, check=True).stderr
+    us = [int(m.group(1)) for m in re.finditer(r'^import time:\s+\d+ \|\s+(\d+) \| ' + re.escape(module) + '$', out,
+                                               re.MULTILINE)]
+    return us[-1] / 1e6
+
+
+def run(repeat=3, modules=None, **_):
+    results = list()
+    for module in modules or BUDGETS:
+        times = sorted(import_time(module) for _ in range(repeat))
+        budget = BUDGETS.get(module)
+        results.append({'benchmark': f"import[{module}]", 'repeat': repeat, 'min_s': times[0],
+                        'median_s': times[len(times) // 2], 'budget_s': budget,
+                        'over_budget': budget is not None and times[0] > budget})
+    return results
+
+
+if __name__ == '__main__':
+    p = parser(__doc__)
+    p.add_argument('--modules', nargs='+', help="modules to import, defaults to all budgeted ones")
+    report(run(**vars(p.parse_args())))
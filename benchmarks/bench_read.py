@@ -0,0 +1,32 @@
+"""
+Cost of reading stored timeseries with both storage backends.
+"""
+from benchmarks.common import configure, reset, measure, report, parser
+from benchmarks.synthetic import product_ids, populate
+
+
+def run(products=10, years=2, repeat=3, db=None):
+    configure(db)
+    reset()
+    import config as cfg
+    import utils
+    from storage import get_store
+    ids = product_ids(products)
+    results = list()
+    for backend in ('columnar', 'csv'):
+        cfg.TIMESERIES_BACKEND = backend
+        store = get_store(backend)
+        rows = populate(ids, years, store)
+        results.append(measure(f"read_timeseries[{backend}]", lambda: [utils.read_timeseries(p) for p in ids],
+                               repeat, products=products, rows=rows))
+        results.append(measure(f"last_epoch[{backend}]", lambda: [store.last_epoch(p) for p in ids],
+                               repeat, products=products, rows=rows))
+        results.append(measure(f"meta[{backend}]", lambda: [store.meta(p) for p in ids],
+                               repeat, products=products, rows=rows))
+        results.append(measure(f"read_from[{backend}]", lambda: [store.read_from(p, 0) for p in ids],
+                               repeat, products=products, rows=rows))
+    return results
+
+
+if __name__ == '__main__':
+    report(run(**vars(parser(__doc__).parse_args())))
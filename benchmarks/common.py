@@ -0,0 +1,83 @@
+"""
+Helpers shared by the benchmarks: an isolated local db, timing and memory measurements and reporting.
+"""
+import argparse
+import logging
+import os
+import statistics
+import tempfile
+import time
+import tracemalloc
+import pandas as pd
+import config as cfg
+
+
+def configure(db=None, quiet=True, **settings):
+    """
+    Points every local db path of the config to db (a new temporary directory by default) and overrides config
+    settings. Must be called before the benchmarked modules are imported, as some of them read the config for
+    default arguments.
+    :param quiet: silences info and debug logs, which would otherwise dominate the output.
+    :return: the db directory.
+    """
+    if quiet:
+        logging.disable(logging.INFO)
+    db = db or tempfile.mkdtemp(prefix='cryptobot-bench-')
+    old = cfg.PATH_DB
+    for name in [n for n in dir(cfg) if n.startswith('PATH_DB')]:
+        setattr(cfg, name, os.path.join(db, os.path.relpath(getattr(cfg, name), old)))
+    for name, value in settings.items():
+        setattr(cfg, name, value)
+    return db
+
+
+def reset():
+    """
+    Drops the process-wide stores, price panel and feature registry, so that the next use starts cold from the
+    configured db.
+    """
+    import panel
+    import registry
+    import storage
+    storage._stores.clear()
+    panel._panel = None
+    registry._registry = None
+
+
+def measure(name, fun, repeat=3, setup=None, **info) -> dict:
+    """
+    Times repeat calls of fun, each preceded by an untimed call of setup, then traces one more call for its peak
+    memory.
+    :param info: extra columns of the report, e.g. the number of rows.
+    """
+    times = list()
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start_time = time.perf_counter()
+        fun()
+        times.append(time.perf_counter() - start_time)
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    try:
+        fun()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {'benchmark': name, 'repeat': repeat, 'min_s': min(times), 'median_s': statistics.median(times),
+            'peak_mb': peak / 2**20, **info}
+
+
+def report(results):
+    df = pd.DataFrame(results).convert_dtypes()
+    print(df.astype(object).where(df.notna(), '').to_string(index=False, float_format=lambda x: f"{x:.4f}"))
+
+
+def parser(description, products=10, years=2, repeat=3) -> argparse.ArgumentParser:
+    p = argparse.ArgumentParser(description=description)
+    p.add_argument('--products', type=int, default=products, help="number of synthetic products")
+    p.add_argument('--years', type=int, default=years, help="years of candles per product")
+    p.add_argument('--repeat', type=int, default=repeat, help="timed repeats of each benchmark")
+    p.add_argument('--db', default=None, help="local db directory, a temporary one by default")
+    return p
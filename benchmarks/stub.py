@@ -0,0 +1,67 @@
+"""
+Local stand-in for the cbpro client, serving synthetic candles.
+"""
+import datetime
+import random
+import threading
+import time
+import numpy as np
+import config as cfg
+from benchmarks.synthetic import candles, product_ids
+
+
+class StubClient:
+    """
+    Implements the two client methods used by the package, get_products and get_product_historic_rates, on
+    synthetic data. Like the exchange, candles are returned newest first, errors are returned as a dict with a message,
+    and windows before a product was listed are empty.
+    """
+
+    def __init__(self, products=None, start=None, granularity=cfg.GRANULARITY, latency=0., failure_rate=0.):
+        """
+        :param products: listed product ids, defaults to 10 synthetic products.
+        :param start: epoch at which the products were listed, defaults to the start of cfg.START_YEAR.
+        :param latency: seconds each request takes.
+        :param failure_rate: probability of a request returning an error.
+        """
+        self.products = list(products or product_ids(10))
+        self.start = start or int(datetime.datetime(cfg.START_YEAR, 1, 1).timestamp())
+        self.granularity = granularity
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.calls = 0
+        self._candles = dict()
+        self._lock = threading.Lock()
+
+    def get_products(self):
+        return [{'id': p, 'base_currency': p.split('-')[0], 'quote_currency': p.split('-')[1],
+                 'display_name': p.replace('-', '/'), 'status': 'online'} for p in self.products]
+
+    def _series(self, product_id):
+        with self._lock:
+            if product_id not in self._candles:
+                # the last complete candle.
+                stop = (time.time() // self.granularity - 1) * self.granularity
+                self._candles[product_id] = candles(product_id, self.start, stop, self.granularity)
+            return self._candles[product_id]
+
+    def get_product_historic_rates(self, product_id, start=None, end=None, granularity=None):
+        with self._lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if random.random() < self.failure_rate:
+            return {'message': 'Slow rate limit exceeded'}
+        if product_id not in self.products:
+            return {'message': 'NotFound'}
+        if granularity != self.granularity:
+            return {'message': 'Unsupported granularity'}
+        data = self._series(product_id)
+        i0 = np.searchsorted(data[:, 0], _timestamp(start), side='left')
+        i1 = np.searchsorted(data[:, 0], _timestamp(end), side='right')
+        return [[int(r[0]), *r[1:].tolist()] for r in data[i0:i1][::-1]]
+
+
+def _timestamp(iso):
+    # naive datetimes are local time, as in Fetcher.
+    return datetime.datetime.fromisoformat(iso).timestamp()
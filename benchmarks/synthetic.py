@@ -0,0 +1,60 @@
+"""
+Synthetic candles: a geometric random walk per product, seeded by the product id so that runs are repeatable.
+"""
+import datetime
+import zlib
+import numpy as np
+import pandas as pd
+import config as cfg
+
+
+def product_ids(n, quote='EUR') -> list:
+    return [f"SYN{i}-{quote}" for i in range(n)]
+
+
+def start_epoch(years, stop=None):
+    """
+    Epoch years before stop (default now).
+    """
+    stop = stop or datetime.datetime.now().timestamp()
+    return int(stop - years * 365.25 * 24 * 3600)
+
+
+def candles(product_id, start, stop, granularity=cfg.GRANULARITY, price=100., volatility=0.01) -> np.ndarray:
+    """
+    Candles on the granularity grid with start <= epoch <= stop, ascending.
+    :return: array with the columns of get_product_historic_rates: epoch, low, high, open, close, volume.
+    """
+    rng = np.random.default_rng(zlib.crc32(product_id.encode()))
+    epochs = np.arange(-(-int(start) // granularity) * granularity, int(stop) + 1, granularity)
+    n = len(epochs)
+    close = price * np.exp(np.cumsum(rng.normal(0., volatility, n)))
+    open_ = np.concatenate([[price], close[:-1]])
+    spread = np.abs(rng.normal(0., volatility / 2, (2, n)))
+    high = np.maximum(open_, close) * (1 + spread[0])
+    low = np.minimum(open_, close) * (1 - spread[1])
+    volume = rng.lognormal(3., 1., n)
+    return np.column_stack([epochs, low, high, open_, close, volume])
+
+
+def frame(product_id, start, stop, granularity=cfg.GRANULARITY) -> pd.DataFrame:
+    """
+    Candles as stored: a df indexed by epoch with low, high, open, close and volume columns.
+    """
+    c = candles(product_id, start, stop, granularity)
+    return pd.DataFrame({'low': c[:, 1], 'high': c[:, 2], 'open': c[:, 3], 'close': c[:, 4], 'volume': c[:, 5]},
+                        index=pd.Index(c[:, 0].astype(np.int64), name='epoch'))
+
+
+def populate(products, years, store, granularity=cfg.GRANULARITY, stop=None):
+    """
+    Writes years of candles up to stop (default now) for each product to the store.
+    :return: total number of rows written.
+    """
+    stop = stop or datetime.datetime.now().timestamp() - granularity
+    rows = 0
+    for p in products:
+        df = frame(p, start_epoch(years, stop), stop, granularity)
+        store.write(p, df)
+        rows += df.shape[0]
+    return rows
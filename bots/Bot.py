@@ -1,13 +1,21 @@
 import datetime
+import logging
 from Coin import CoinTimeSeries
-from utils import round_now_to_minute, list_local_products, filename_history, filename_features, dir_history, \
-                  dir_features, get_logger
+from utils import round_now_to_minute, list_local_products, filename_history, feature_table, dir_history, \
+                  dir_features, get_logger, read_timeseries
+from features import rolling_means
+from registry import FeatureSpec, get_registry
+from events import CrossoverIndex
+from storage import FeatureStore
+from history import HistoryLog
+from backtest import simulate, summary
 import time
+import numpy as np
 from numpy.random import choice
 import pandas as pd
 import os
-from threading import Thread
 import config as cfg
+import metrics
 
 class Bot(CoinTimeSeries):
     """
@@ -34,7 +42,7 @@ class Bot(CoinTimeSeries):
         """
         super().__init__(product)
         self.logger = get_logger(product + '_' + self.__class__.__name__ )
-        self.logger.info(f'Creating bot for {product}.')
+        self.logger.info("Creating bot for %s.", product)
         self.created = datetime.datetime.now().isoformat()
         self.params = params
         self._rec_status = None
@@ -42,16 +50,15 @@ class Bot(CoinTimeSeries):
         self.bot_name = self.__class__.__name__
         # TODO: all this file i/o business should be heandled with another class actually.
         self._filepath_history = filename_history(self.bot_name, self.product)
-        self._filepath_feature = filename_features(self.bot_name, self.product)
+        self._feature_store = FeatureStore()
 
         # make the directories if necessary
         for d in [dir_features(self.bot_name), dir_history(self.bot_name)]:
             if not os.path.exists(d):
-                self.logger.info(f"Creating directory {d}")
+                self.logger.info("Creating directory %s", d)
                 os.makedirs(d, exist_ok=True)
 
-        self._history = pd.DataFrame(columns=list(self.rec_status.keys()))
-        self._history.to_csv(self._filepath_history)
+        self._history = HistoryLog(self._filepath_history, columns=list(self.rec_status.keys()))
         self.default_value = pd.DataFrame()
 
     def __repr__(self):
@@ -63,20 +70,47 @@ class Bot(CoinTimeSeries):
                f"first data point: {self.first_time_point }\n" \
                f"last data point: {self.last_time_point }\n"
 
+    @classmethod
+    def key_of(cls, **params):
+        """
+        Short name of a parameter set, keeping the persisted state of bots of one class with different parameters
+        apart. None if the class has no parameters that change its state.
+        """
+        return None
+
+    @property
+    def key(self):
+        return self.key_of(**self.params)
+
+    @property
+    def feature_table(self):
+        """
+        Table of the features in the feature store of the bot, one per product and parameter set.
+        """
+        return feature_table(self.product, self.key)
+
+    @property
+    def source(self):
+        """
+        Marker of the stored product the features are computed from, changes when the product is rewritten.
+        """
+        state = self._store.state(self.product)
+        return state.inode if state is not None else None
+
     @property
     def current_time(self):
         return int(round_now_to_minute().timestamp())
 
     @property
     def history(self):
-        self._history = pd.read_csv(self._filepath_history, index_col=0, header=0)
-        return self._history
+        """
+        Complete recommendation history read from disk.
+        """
+        return self._history.read()
 
     def update_history(self, value: dict):
-        self.logger.info(f"Updating history file for bot {self.__class__.__name__}.")
-        self._history = self._history.append(pd.DataFrame.from_dict([value]))
-        # TODO: Can be switched to append mode.
-        self._history.to_csv(self._filepath_history)
+        self.logger.info("Updating history file for bot %s.", self.__class__.__name__)
+        self._history.append(value)
 
     def feature_fun(self):
         """
@@ -88,11 +122,13 @@ class Bot(CoinTimeSeries):
     @property
     def features(self) -> pd.DataFrame:
         """
-        Transforms params to features.
+        Transforms params to features. Only rows that are not yet persisted are written to the feature store.
         :return:
         """
-        f = self.feature_fun()
-        f.to_csv(self._filepath_feature)
+        with metrics.timer('bot_feature_seconds', bot=self.bot_name, product=self.product):
+            f = self.feature_fun()
+        if isinstance(f, pd.DataFrame) and not f.empty:
+            self._feature_store.append(self.bot_name, self.feature_table, f, source=self.source)
         return f
 
     @property
@@ -101,10 +137,11 @@ class Bot(CoinTimeSeries):
         Returns the latest available feature values
         :return:
         """
-        if isinstance(self.features, pd.DataFrame):
-            return self.features.loc[self.features.index.max()].to_frame().T
+        f = self.features
+        if isinstance(f, pd.DataFrame):
+            return f.loc[f.index.max()].to_frame().T
         else:
-            return self.features
+            return f
 
     def decision_fun(self):
         """
@@ -118,7 +155,8 @@ class Bot(CoinTimeSeries):
         Transforms features to decision.
         :return:
         """
-        return self.decision_fun()
+        with metrics.timer('bot_decision_seconds', bot=self.bot_name, product=self.product):
+            return self.decision_fun()
 
     @property
     def rec_status(self):
@@ -133,11 +171,13 @@ class Bot(CoinTimeSeries):
         self._rec_time = self.current_time
         rec = self.decision()
         self._rec_status = rec
-        self.logger.debug(f'Last reco for bot {self.__class__.__name__} working on {self.product}:\n'
-                            f'{self.rec_status}.')
+        metrics.counter('bot_recommendations_total', bot=self.bot_name, rec=str(rec)).inc()
+        self.logger.debug("Last reco for bot %s working on %s:\n%s.", self.__class__.__name__, self.product,
+                          self.rec_status)
         self.update_history(self.rec_status)
-        self.logger.debug(f'History (last 3 entries) for bot {self.__class__.__name__} working on {self.product}:\n'
-                            f'{self.history.tail(3)}.')
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug("History (last 3 entries) for bot %s working on %s:\n%s.",
+                              self.__class__.__name__, self.product, self._history.recent(3))
 
     def run(self):
         """
@@ -147,25 +187,70 @@ class Bot(CoinTimeSeries):
             self.update_rec()
             time.sleep(cfg.GRANULARITY)
 
-    # TODO: Make a fun to retrospectively generate recos.
+    def on_new_candles(self, epoch):
+        """
+        Called by the scheduler when new candles of the product are stored, up to epoch.
+        """
+        self.update_rec()
+
+    @classmethod
+    def signal_fun(cls, value: pd.Series, **params) -> pd.Series:
+        """
+        Vectorized decision rule, the recommendation at every sample of value in one pass. Must be overwritten
+        according to the subclass behavior, consistently with decision_fun.
+        :return: Series of recommendations indexed like value.
+        """
+        return pd.Series(choice(cls.outcomes, size=len(value)), index=value.index)
+
+    @classmethod
+    def backtest_value(cls, value: pd.Series, **params) -> pd.DataFrame:
+        """
+        Retrospectively generates recommendations over a whole price series and simulates a simple long-only
+        strategy: invested after a Buy, out after a Sell, unchanged otherwise.
+        :return: df indexed like value with rec, position, returns, strategy returns and equity columns.
+        """
+        rec = cls.signal_fun(value, **params)
+        position, returns, strategy, equity = simulate(value.values, rec.map({'Buy': 1., 'Sell': 0.}).values)
+        return pd.DataFrame({'value': value, 'rec': rec, 'position': position, 'returns': returns,
+                             'strategy': strategy, 'equity': equity}, index=value.index)
+
+    def backtest(self) -> pd.DataFrame:
+        """
+        Backtest of this bot's decision rule over the entire stored history of its product.
+        """
+        return self.backtest_value(self.value, **self.params)
+
+    @staticmethod
+    def backtest_summary(result: pd.DataFrame) -> dict:
+        """
+        Summarizes a backtest result: strategy and buy and hold returns, number of trades and time in the market.
+        """
+        return summary(result['position'].values, result['returns'].values, result['equity'].values)
 
 
 class MaBot(Bot):
     """
         Moving average bot.
+
+        The moving averages are requested from the process-wide feature registry, which computes each window once
+        per new candle for all bots of the process and persists its state, so a restarted bot resumes from where it
+        stopped. Crossovers of the averages are kept in a persisted event index, updated from new feature rows only.
     """
     def __init__(self, product: str = 'ETH-EUR', **params):
         super().__init__(product, **params)
         if 'window_length' not in list(params):
             raise ValueError("ma_Bot needs a param argument with keys 'window_length'.")
+        self._registry = get_registry()
+        self._specs = {w: FeatureSpec.of('ma', self.product, window=4*24*w) for w in self.params['window_length']}
+        self._crossovers = CrossoverIndex(self.bot_name, self.product, self.key)
+
+    @classmethod
+    def key_of(cls, **params):
+        windows = params['window_length']
+        return f'{min(windows)}_{max(windows)}'
 
     def feature_fun(self):
-        c = list()
-        for params in self.params['window_length']:
-            c.append(
-                self.data.rolling(4*24*params).mean().rename(columns={'EUR': params})
-            )
-        return pd.concat(c, axis=1)
+        return pd.DataFrame({w: self._registry.get(spec) for w, spec in self._specs.items()})
 
     @property
     def large_window(self):
@@ -181,24 +266,51 @@ class MaBot(Bot):
         """
         return min(self.params['window_length'])
 
+    @classmethod
+    def signal_fun(cls, value: pd.Series, **params) -> pd.Series:
+        windows = params['window_length']
+        means = rolling_means(value.values, {4*24*min(windows), 4*24*max(windows)})
+        small, large = means[4*24*min(windows)], means[4*24*max(windows)]
+        rec = np.where(large > small, "Sell", np.where(large < small, "Buy", None))
+        return pd.Series(rec, index=value.index)
+
     def decision_fun(self):
-        last_value_small_window = self.last_feature_value[self.small_window].values
-        last_value_large_window = self.last_feature_value[self.large_window].values
-        self.logger.info(f"Last value small window: {last_value_small_window}")
-        self.logger.info(f"Last value big window: {last_value_large_window}")
-        if last_value_large_window > last_value_small_window:
+        features = self.features
+        self._crossovers.update(features.index.values, features[self.small_window].values,
+                                features[self.large_window].values, source=self.source)
+        self.logger.info("Last crossover: %s", self._crossovers.last_event())
+        small, large = (features[w].values[-1] if len(features) else np.nan
+                        for w in (self.small_window, self.large_window))
+        # no recommendation while an average is undefined (warm-up) or the averages are equal, as in signal_fun.
+        if np.isnan(small) or np.isnan(large) or small == large:
+            return None
+        # otherwise the sign of small - large only changes at a crossover, so it is the current recommendation.
+        if self._crossovers.sign < 0:
             return "Sell"
-        elif last_value_large_window < last_value_small_window:
+        elif self._crossovers.sign > 0:
             return "Buy"
         else:
             return None
 
 
+def backtest_products(bot_class=None, products=None, **params) -> pd.DataFrame:
+    """
+    Backtests a bot class on all (or given) local products without instantiating bots.
+    :return: one row of backtest summary per product, sorted by strategy return.
+    """
+    bot_class = bot_class or MaBot
+    summaries = dict()
+    for product in products or list_local_products():
+        df = read_timeseries(product)
+        if df is None or df.empty:
+            continue
+        summaries[product] = bot_class.backtest_summary(bot_class.backtest_value(df['close'], **params))
+    return pd.DataFrame.from_dict(summaries, orient='index').sort_values('strategy_return', ascending=False)
+
+
 if __name__ == '__main__':
-    bots = [MaBot(product=p, window_length=[90, 30]) for p in list_local_products()]
-    threads = [Thread(target=b.run) for b in bots]
-    for thread in threads:
-        thread.start()
+    from runner import BotRunner
+    BotRunner(MaBot, window_length=[90, 30]).run()
 
 
 
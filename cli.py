@@ -0,0 +1,85 @@
+"""
+Command line entry point.
+
+    python cli.py fetch                  fetch all EUR products from Coinbase, forever.
+    python cli.py bots                   run the moving average bots on all local products.
+    python cli.py dashboard              serve the dashboard.
+    python cli.py backtest               backtest the moving average bot on all local products.
+
+Each command imports what it needs only when it runs, so that `python cli.py --help` and short-lived invocations do
+not pay for pandas, dash or the exchange client. See `python cli.py <command> --help` for the options.
+"""
+import argparse
+import config as cfg
+
+
+def fetch(args):
+    import metrics
+    from Fetcher import FetcherArmy
+    from utils import product_list
+    metrics.start('fetcher')
+    army = FetcherArmy(args.products or product_list(tuple(args.currency)))
+    if args.repair_gaps:
+        army.repair_gaps()
+    {'async': army.run_async, 'threaded': army.run_threaded, 'serial': army.run}[args.mode]()
+
+
+def bots(args):
+    from bots.Bot import MaBot
+    from runner import BotRunner
+    BotRunner(MaBot, products=args.products, workers=args.workers, window_length=args.window_length).run()
+
+
+def dashboard(args):
+    import metrics
+    import visuals
+    metrics.start('dashboard')
+    visuals.app.run_server(host=args.host, port=args.port, debug=False, dev_tools_hot_reload=False)
+
+
+def backtest(args):
+    from bots.Bot import MaBot, backtest_products
+    summaries = backtest_products(MaBot, products=args.products, window_length=args.window_length)
+    print(summaries.head(args.top).to_string())
+
+
+def parser() -> argparse.ArgumentParser:
+    p = argparse.ArgumentParser(prog='cli.py', description=__doc__,
+                                formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = p.add_subparsers(dest='command', required=True)
+
+    c = commands.add_parser('fetch', help="fetch candles from Coinbase into the local db")
+    c.add_argument('--products', nargs='+', help="product ids, defaults to all products quoted in --currency")
+    c.add_argument('--currency', nargs='+', default=['EUR'], help="quote currencies of the products to fetch")
+    c.add_argument('--mode', default='async', choices=['async', 'threaded', 'serial'], help="FetcherArmy runner")
+    c.add_argument('--repair-gaps', action='store_true', help="refetch missing candles before fetching new ones")
+    c.set_defaults(run=fetch)
+
+    c = commands.add_parser('bots', help="run moving average bots on new candles")
+    c.add_argument('--products', nargs='+', help="product ids, defaults to all local products")
+    c.add_argument('--workers', type=int, default=cfg.RUNNER_WORKERS, help="worker processes")
+    c.add_argument('--window-length', nargs=2, type=int, default=[90, 30], help="long and short windows in days")
+    c.set_defaults(run=bots)
+
+    c = commands.add_parser('dashboard', help="serve the dashboard")
+    c.add_argument('--host', default='127.0.0.1')
+    c.add_argument('--port', type=int, default=8050)
+    c.set_defaults(run=dashboard)
+
+    c = commands.add_parser('backtest', help="backtest the moving average bot on local products")
+    c.add_argument('--products', nargs='+', help="product ids, defaults to all local products")
+    c.add_argument('--window-length', nargs=2, type=int, default=[90, 30], help="long and short windows in days")
+    c.add_argument('--top', type=int, default=20, help="number of products to print, best first")
+    c.set_defaults(run=backtest)
+    return p
+
+
+def main(argv=None):
+    args = parser().parse_args(argv)
+    from utils import set_display_options
+    set_display_options()
+    args.run(args)
+
+
+if __name__ == '__main__':
+    main()
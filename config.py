@@ -4,6 +4,60 @@ PATH_DB = os.path.join(os.getcwd(), 'db', '.')
 PATH_DB_TIMESERIES = os.path.join(PATH_DB, 'timeseries')
 PATH_DB_HISTORY = os.path.join(PATH_DB, 'history')
 PATH_DB_FEATURE = os.path.join(PATH_DB, 'features')
+PATH_DB_COLUMNAR = os.path.join(PATH_DB, 'columnar')
+PATH_DB_CHECKPOINTS = os.path.join(PATH_DB, 'checkpoints')
+PATH_DB_GAPS = os.path.join(PATH_DB, 'gaps')
+PATH_DB_SWEEPS = os.path.join(PATH_DB, 'sweeps')
+PATH_DB_EVENTS = os.path.join(PATH_DB, 'events')
+PATH_DB_METRICS = os.path.join(PATH_DB, 'metrics')
+PATH_DB_PRODUCTS = os.path.join(PATH_DB, 'products.json')
 GRANULARITY = 60*60 # 15 minutes
 START_YEAR = 2021
 RENDER_OPTION = "image"
+# Timeseries storage backend, "csv" or "columnar". An empty columnar store is filled from the csv files on first use.
+TIMESERIES_BACKEND = "columnar"
+# Recommendation history: pending records are flushed every HISTORY_FLUSH_ROWS records or HISTORY_FLUSH_SECONDS.
+HISTORY_FLUSH_ROWS = 100
+HISTORY_FLUSH_SECONDS = 5
+HISTORY_RING_SIZE = 100
+# Asynchronous fetching: shared request rate limit (requests per second), requests in flight, per request timeout
+# (seconds) and retries with exponential backoff (seconds).
+FETCH_RATE_LIMIT = 10
+FETCH_CONCURRENCY = 8
+FETCH_TIMEOUT = 10
+FETCH_RETRIES = 3
+FETCH_BACKOFF = 0.5
+# Product catalogue of the exchange: cached under PATH_DB_PRODUCTS and refreshed after PRODUCTS_TTL seconds.
+PRODUCTS_TTL = 24 * 60 * 60
+# Bot scheduling: size of the worker pool running bots and polling interval (seconds) of the timeseries watcher.
+SCHEDULER_WORKERS = 4
+WATCH_INTERVAL = 10
+# Process-pool bot runner: number of worker processes (None for one per core), delay (seconds) before restarting a
+# crashed worker.
+RUNNER_WORKERS = None
+RUNNER_RESTART_DELAY = 5
+# Feature registry shared by the bots of a process: maximum number of cached features and their total size (bytes).
+FEATURE_CACHE_MAX_ENTRIES = 1024
+FEATURE_CACHE_MAX_BYTES = 256 * 2**20
+# Dashboard: refresh interval (seconds) of stale panels and number of processes rendering PNG panels.
+DASH_REFRESH_SECONDS = 300
+DASH_RENDER_WORKERS = 4
+# Dashboard traces are downsampled to at most DASH_MAX_POINTS points with "lttb" or "minmax".
+DASH_MAX_POINTS = 1000
+DASH_DOWNSAMPLING = "lttb"
+# Dashboard ranking: number of products shown per recommendation and feature rows used to score their signal.
+DASH_TOP_K = 10
+DASH_RANK_ROWS = 24 * 7
+# Window lengths (days) of the MaBot whose features and crossover events the dashboard shows.
+DASH_WINDOW_LENGTH = [90, 30]
+# Metrics (see metrics.py): disabled by default. When enabled, each component listed in METRICS_PORTS serves them as
+# text on http://127.0.0.1:<its port>/metrics, and every process dumps them as JSON under PATH_DB_METRICS every
+# METRICS_DUMP_SECONDS. Components need distinct ports, e.g. {'fetcher': 9100, 'dashboard': 9101}.
+METRICS_ENABLED = False
+METRICS_PORTS = {}
+METRICS_DUMP_SECONDS = 60
+
+# Logging (see utils.get_logger): default level and per-component overrides, keyed by full logger name (e.g.
+# 'BTC-EUR_Fetcher') or by component, the part after the last underscore (e.g. 'Fetcher', 'MaBot', 'FetcherArmy...').
+LOG_LEVEL = "INFO"
+LOG_LEVELS = {}
@@ -0,0 +1,70 @@
+"""
+Downsampling of plotted series.
+
+A panel does not need more points than it has pixels. Series are reduced to at most a given number of points by
+largest-triangle-three-buckets (LTTB), which keeps the visual shape, or by min/max bucketing, which keeps every
+extreme.
+"""
+import numpy as np
+
+
+def lttb(x, y, n_out) -> np.ndarray:
+    """
+    Largest-triangle-three-buckets: first and last points, plus in each of n_out - 2 buckets the point forming the
+    largest triangle with the previously selected point and the average of the next bucket.
+    :return: ascending indices of the selected points.
+    """
+    n = len(y)
+    if n <= n_out or n_out < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        next_lo, next_hi = (edges[i + 1], edges[i + 2]) if i + 2 < len(edges) else (n - 1, n)
+        avg_x, avg_y = x[next_lo:next_hi].mean(), y[next_lo:next_hi].mean()
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+def minmax(y, n_out) -> np.ndarray:
+    """
+    Min/max bucketing: the smallest and the largest point of each of n_out / 2 buckets, plus first and last points.
+    :return: ascending indices of the selected points.
+    """
+    n = len(y)
+    if n <= n_out or n_out < 4:
+        return np.arange(n)
+    y = np.asarray(y, dtype=float)
+    edges = np.linspace(0, n, (n_out - 2) // 2 + 1).astype(int)
+    selected = [0, n - 1]
+    for lo, hi in zip(edges[:-1], edges[1:]):
+        selected += [lo + int(np.argmin(y[lo:hi])), lo + int(np.argmax(y[lo:hi]))]
+    return np.unique(selected)
+
+
+def downsample(x, y, n_out, keep=None, method='lttb') -> np.ndarray:
+    """
+    Selects at most n_out points of (x, y), ignoring missing values, plus the points at the indices in keep.
+    :param keep: indices of points that are always selected, they do not count towards n_out unless there are
+    fewer of them than n_out.
+    :param method: 'lttb' or 'minmax'.
+    :return: ascending indices into x and y.
+    """
+    y = np.asarray(y, dtype=float)
+    finite = np.flatnonzero(~np.isnan(y))
+    keep = np.empty(0, dtype=np.int64) if keep is None else np.asarray(keep, dtype=np.int64)
+    budget = max(n_out - len(keep), 3)
+    if method == 'lttb':
+        selected = lttb(np.asarray(x)[finite], y[finite], budget)
+    elif method == 'minmax':
+        selected = minmax(y[finite], budget)
+    else:
+        raise ValueError(f"Unknown downsampling method {method}.")
+    return np.union1d(finite[selected], keep)
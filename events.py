@@ -0,0 +1,139 @@
+"""
+Persisted index of moving average crossover events.
+
+Every time the small moving average of a bot crosses its large moving average an event (epoch, direction, magnitude)
+is appended to a columnar table under `db/events/<bot>/<product>/<key>/`, where key identifies the parameters of
+the bot (e.g. `30_90` for the windows of a `MaBot`), so that bots with different parameters keep separate events.
+The index is maintained incrementally from new feature rows only, and answers "events in range" by binary search and
+"last event" in O(1), so neither decisions nor switch markers on the dashboard need to scan the feature history.
+"""
+import json
+import os
+import numpy as np
+import pandas as pd
+import config as cfg
+from storage import ColumnarTable
+from utils import get_logger
+
+logger = get_logger('events')
+
+# direction is +1 when the small average crosses above the large one (Buy), -1 when it crosses below (Sell).
+# magnitude is the distance between the averages relative to the large one, at the first sample after the crossing.
+EVENT_DTYPES = {'epoch': '<i8', 'direction': '<i8', 'magnitude': '<f8'}
+
+
+class CrossoverIndex:
+    """
+    Crossover events of one bot and product, together with the state needed to continue the detection: the last
+    processed epoch, the current sign of small - large and the source of the features the events were detected in.
+    """
+
+    def __init__(self, bot_name, product_id, key, path=None):
+        """
+        :param key: parameters of the bot, as returned by `Bot.key`.
+        """
+        self.bot_name = bot_name
+        self.product_id = product_id
+        self.key = key
+        self.path = os.path.join(path or cfg.PATH_DB_EVENTS, bot_name, product_id, key)
+        self.table = ColumnarTable(self.path, EVENT_DTYPES)
+        self.last_epoch = None
+        self.sign = 0
+        self.source = None
+        self.load()
+
+    @property
+    def filename(self):
+        return os.path.join(self.path, 'state.json')
+
+    def __len__(self):
+        return len(self.table)
+
+    def load(self):
+        """
+        Loads the detection state.
+        :return: True if it exists.
+        """
+        try:
+            with open(self.filename, 'r') as f:
+                d = json.load(f)
+        except FileNotFoundError:
+            return False
+        self.last_epoch, self.sign, self.source = d['last_epoch'], d['sign'], d.get('source')
+        return True
+
+    def save(self):
+        os.makedirs(self.path, exist_ok=True)
+        tmp = self.filename + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'last_epoch': self.last_epoch, 'sign': self.sign, 'source': self.source}, f)
+        os.replace(tmp, self.filename)
+
+    def reset(self):
+        """
+        Drops all events and the detection state.
+        """
+        self.table.write({c: np.empty(0, dtype=dtype) for c, dtype in EVENT_DTYPES.items()})
+        self.last_epoch, self.sign = None, 0
+
+    def update(self, epochs, small, large, source=None):
+        """
+        Detects crossovers in the samples newer than the last processed epoch and appends them to the index.
+        Samples where either average is missing or both are equal do not change the sign.
+        :param source: marker of the data the averages were computed from (see `storage.FeatureStore.write`). If it
+        changed, e.g. because the product was repaired, the index is rebuilt from all samples.
+        :return: number of new events.
+        """
+        if source != self.source:
+            if self.last_epoch is not None:
+                logger.info("Features of %s/%s were recomputed, rebuilding its crossover index.", self.bot_name,
+                            self.product_id)
+            self.reset()
+            self.source = source
+        epochs = np.asarray(epochs, dtype=np.int64)
+        if self.last_epoch is not None:
+            i = int(np.searchsorted(epochs, self.last_epoch, side='right'))
+            epochs, small, large = epochs[i:], small[i:], large[i:]
+        if not len(epochs):
+            return 0
+        small, large = np.asarray(small, dtype=float), np.asarray(large, dtype=float)
+        sign = np.nan_to_num(np.sign(small - large))
+        valid = np.flatnonzero(sign != 0)
+        # carry the sign over samples where it is undefined, starting from the sign before these samples.
+        signs = np.concatenate([[self.sign], sign[valid]])
+        change = np.flatnonzero((signs[1:] != signs[:-1]) & (signs[:-1] != 0))
+        at = valid[change]
+        events = {'epoch': epochs[at], 'direction': signs[1:][change].astype(np.int64),
+                  'magnitude': np.abs(small[at] - large[at]) / large[at]}
+        last = self.last_event()
+        if last is not None:
+            # events written before an interrupted save of the state.
+            new = events['epoch'] > last['epoch']
+            events = {c: a[new] for c, a in events.items()}
+        if len(events['epoch']):
+            self.table.append(events)
+        if len(valid):
+            self.sign = int(sign[valid[-1]])
+        self.last_epoch = int(epochs[-1])
+        self.save()
+        return len(events['epoch'])
+
+    def events(self, start=None, stop=None) -> pd.DataFrame:
+        """
+        Events with start <= epoch <= stop, found by binary search on the memory-mapped epochs.
+        :return: df indexed by epoch with direction and magnitude columns.
+        """
+        epoch = self.table.column('epoch')
+        i0 = 0 if start is None else int(np.searchsorted(epoch, start, side='left'))
+        i1 = len(epoch) if stop is None else int(np.searchsorted(epoch, stop, side='right'))
+        return pd.DataFrame({c: self.table.column(c, mmap=False, start=i0, stop=i1)
+                             for c in ['direction', 'magnitude']}, index=pd.Index(np.array(epoch[i0:i1]), name='epoch'))
+
+    def last_event(self):
+        """
+        :return: dict with the epoch, direction and magnitude of the last event, None if there is none.
+        """
+        n = len(self.table)
+        if n == 0:
+            return None
+        return {c: self.table.column(c, mmap=False, start=n - 1, stop=n)[0].item() for c in EVENT_DTYPES}
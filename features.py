@@ -0,0 +1,161 @@
+"""
+Feature computation helpers shared by bots.
+"""
+import os
+import numpy as np
+import pandas as pd
+
+
+class RollingMean:
+    """
+    Incremental rolling mean over the last `window` samples with O(1) work per new sample.
+
+    Matches pandas' `rolling(window).mean()`: the mean is NaN unless all samples in the window are valid. The running
+    sum is recomputed exactly from the buffer once per window length to keep floating point drift bounded.
+    """
+
+    def __init__(self, window: int):
+        self.window = int(window)
+        self.buffer = np.full(self.window, np.nan)
+        self.head = 0  # position of the oldest sample in the ring buffer.
+        self.seen = 0
+        self.sum = 0.0
+        self.count = 0
+
+    def push(self, x: float) -> float:
+        old = self.buffer[self.head]
+        if old == old:  # not nan
+            self.sum -= old
+            self.count -= 1
+        self.buffer[self.head] = x
+        if x == x:
+            self.sum += x
+            self.count += 1
+        self.head = (self.head + 1) % self.window
+        self.seen += 1
+        if self.head == 0:
+            self.sum = float(np.nansum(self.buffer))
+        if self.count == self.window:
+            return self.sum / self.window
+        return np.nan
+
+    def extend(self, values) -> np.ndarray:
+        """
+        Pushes a batch of samples and returns the rolling means at each of them. Long batches (e.g. the first replay
+        of a history) are computed with a vectorized cumulative sum instead of one push per sample.
+        """
+        values = np.asarray(values, dtype=float)
+        if len(values) < self.window:
+            return np.array([self.push(x) for x in values])
+        history = np.roll(self.buffer, -self.head)[max(self.window - self.seen, 0):]
+        out = rolling_mean(np.concatenate([history, values]), self.window)[len(history):]
+        self.buffer = values[-self.window:].copy()
+        self.head = 0
+        self.seen += len(values)
+        self.count = int(np.sum(~np.isnan(self.buffer)))
+        self.sum = float(np.nansum(self.buffer))
+        return out
+
+    def state(self) -> np.ndarray:
+        """
+        Samples in the window, oldest first.
+        """
+        return np.roll(self.buffer, -self.head)[max(self.window - self.seen, 0):]
+
+
+def cumulative_sums(values):
+    """
+    Cumulative sums of valid values and counts of valid values, both with a leading zero, from which rolling means of
+    any window length are O(n).
+    """
+    values = np.asarray(values, dtype=float)
+    valid = ~np.isnan(values)
+    csum = np.concatenate([[0.], np.cumsum(np.where(valid, values, 0.))])
+    ccount = np.concatenate([[0], np.cumsum(valid)])
+    return csum, ccount
+
+
+def rolling_mean_from_sums(csum, ccount, window: int) -> np.ndarray:
+    n = len(csum) - 1
+    out = np.full(n, np.nan)
+    if n >= window:
+        s = csum[window:] - csum[:-window]
+        c = ccount[window:] - ccount[:-window]
+        out[window - 1:] = np.where(c == window, s / window, np.nan)
+    return out
+
+
+def rolling_mean(values, window: int) -> np.ndarray:
+    """
+    Vectorized equivalent of pandas' `rolling(window).mean()` on a 1-D array, based on cumulative sums.
+    """
+    return rolling_mean_from_sums(*cumulative_sums(values), window)
+
+
+def rolling_means(values, windows) -> dict:
+    """
+    Rolling means of several window lengths sharing one pass of cumulative sums.
+    :return: dict of window length to rolling mean.
+    """
+    csum, ccount = cumulative_sums(values)
+    return {w: rolling_mean_from_sums(csum, ccount, w) for w in windows}
+
+
+class MovingAverageEngine:
+    """
+    Keeps one incremental rolling mean per named window and turns newly arrived samples into feature rows.
+
+    The state can be saved to and restored from disk, so a restarted bot continues from the last processed epoch
+    instead of replaying the whole history.
+    """
+
+    def __init__(self, windows: dict):
+        """
+        :param windows: mapping of feature name to window length in samples.
+        """
+        self.windows = dict(windows)
+        self.means = {name: RollingMean(w) for name, w in self.windows.items()}
+        self.last_epoch = None
+
+    def update(self, epochs, values) -> pd.DataFrame:
+        """
+        Consumes samples newer than the last processed epoch.
+        :return: df with one row per consumed sample and one column per window, indexed by epoch.
+        """
+        epochs = np.asarray(epochs)
+        values = np.asarray(values, dtype=float)
+        if self.last_epoch is not None:
+            i = epochs > self.last_epoch
+            epochs, values = epochs[i], values[i]
+        df = pd.DataFrame({name: m.extend(values) for name, m in self.means.items()},
+                          index=pd.Index(epochs, name='epoch'))
+        if len(epochs):
+            self.last_epoch = int(epochs[-1])
+        return df
+
+    def save(self, filename):
+        """
+        Persists the state, the window contents are the only thing needed to resume.
+        """
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        arrays = {f"buffer_{i}": m.state() for i, m in enumerate(self.means.values())}
+        tmp = filename + '.tmp.npz'
+        np.savez(tmp, names=np.array([str(n) for n in self.windows]), windows=np.array(list(self.windows.values())),
+                 last_epoch=np.array(-1 if self.last_epoch is None else self.last_epoch), **arrays)
+        os.replace(tmp, filename)
+
+    def load(self, filename) -> bool:
+        """
+        Restores the state saved by `save`. The state is ignored if it was saved for different windows.
+        :return: True if the state was restored.
+        """
+        if not os.path.isfile(filename):
+            return False
+        with np.load(filename) as f:
+            if list(f['names']) != [str(n) for n in self.windows] or list(f['windows']) != list(self.windows.values()):
+                return False
+            for i, m in enumerate(self.means.values()):
+                m.extend(f[f"buffer_{i}"])
+            last_epoch = int(f['last_epoch'])
+        self.last_epoch = None if last_epoch < 0 else last_epoch
+        return True
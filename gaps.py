@@ -0,0 +1,127 @@
+"""
+Index of missing candles in stored timeseries.
+
+A gap is a run of candles missing at `granularity` spacing between the first and the last valid candle of a product,
+either because no row was stored or because the stored row is a placeholder of Nones. Candles before the first valid
+one (product not yet listed) are not gaps. The index is persisted as a small json file per product under `db/gaps/`,
+updated incrementally on append and rebuilt with a full scan only when it does not match the stored data.
+"""
+import json
+import os
+import numpy as np
+import config as cfg
+from storage import get_store
+from utils import get_logger
+
+logger = get_logger('gaps')
+
+
+class GapIndex:
+    """
+    Gaps of one product as inclusive (start, stop) epoch ranges of missing candles.
+    """
+
+    def __init__(self, product_id, granularity=cfg.GRANULARITY, store=None):
+        self.product_id = product_id
+        self.granularity = granularity
+        self.store = store or get_store()
+        self.first_valid = None
+        self.last_valid = None
+        self.gaps = list()
+        self.position = None  # store append position the index is in sync with.
+
+    @property
+    def filename(self):
+        return os.path.join(cfg.PATH_DB_GAPS, self.product_id + '.json')
+
+    def __len__(self):
+        return len(self.gaps)
+
+    @property
+    def missing_candles(self):
+        return sum((stop - start) // self.granularity + 1 for start, stop in self.gaps)
+
+    def update(self, epochs, valid):
+        """
+        Extends the index with appended rows.
+        :param epochs: epochs of the appended rows, ascending.
+        :param valid: boolean mask of rows holding real candles.
+        """
+        epochs = np.asarray(epochs, dtype=np.int64)[np.asarray(valid, dtype=bool)]
+        if self.last_valid is not None:
+            epochs = epochs[epochs > self.last_valid]
+        if len(epochs) == 0:
+            return
+        if self.first_valid is None:
+            self.first_valid = int(epochs[0])
+        else:
+            epochs = np.concatenate([[self.last_valid], epochs])
+        i = np.flatnonzero(np.diff(epochs) > self.granularity)
+        self.gaps.extend([int(epochs[k]) + self.granularity, int(epochs[k + 1]) - self.granularity] for k in i)
+        self.last_valid = int(epochs[-1])
+
+    def build(self):
+        """
+        Rebuilds the index with a full scan of the stored product.
+        """
+        self.first_valid, self.last_valid, self.gaps = None, None, list()
+        state = self.store.state(self.product_id)
+        df = self.store.read(self.product_id)
+        if df is not None:
+            self.update(df.index.values, df['close'].notna().values)
+        self.position = state.size if state is not None else None
+        return self
+
+    def query(self, start=None, stop=None):
+        """
+        Gaps overlapping start <= epoch <= stop.
+        """
+        return [(a, b) for a, b in self.gaps if (start is None or b >= start) and (stop is None or a <= stop)]
+
+    def save(self):
+        state = self.store.state(self.product_id)
+        self.position = state.size if state is not None else None
+        os.makedirs(cfg.PATH_DB_GAPS, exist_ok=True)
+        tmp = self.filename + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'granularity': self.granularity, 'first_valid': self.first_valid,
+                       'last_valid': self.last_valid, 'position': self.position, 'gaps': self.gaps}, f)
+        os.replace(tmp, self.filename)
+
+    def load(self):
+        """
+        Loads the persisted index.
+        :return: True if it exists and is in sync with the stored data.
+        """
+        try:
+            with open(self.filename, 'r') as f:
+                d = json.load(f)
+        except FileNotFoundError:
+            return False
+        state = self.store.state(self.product_id)
+        if d['granularity'] != self.granularity or state is None or d['position'] != state.size:
+            return False
+        self.first_valid, self.last_valid, self.position = d['first_valid'], d['last_valid'], d['position']
+        self.gaps = [list(g) for g in d['gaps']]
+        return True
+
+
+def get_gap_index(product_id, granularity=cfg.GRANULARITY, store=None) -> GapIndex:
+    """
+    Returns the gap index of a product, from disk if it is up to date, otherwise rebuilt and persisted.
+    """
+    index = GapIndex(product_id, granularity, store)
+    if not index.load():
+        logger.info("Gap index of %s is missing or stale, rebuilding it.", product_id)
+        index.build()
+        index.save()
+    return index
+
+
+def windows(gaps, granularity=cfg.GRANULARITY, candles_per_request=300):
+    """
+    Splits gaps into request windows of at most candles_per_request candles.
+    :return: list of inclusive (start, stop) epochs.
+    """
+    step = granularity * candles_per_request
+    return [(s, min(s + step - granularity, stop)) for start, stop in gaps for s in range(start, stop + 1, step)]
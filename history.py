@@ -0,0 +1,131 @@
+"""
+Append-only recommendation history of bots.
+
+Records are appended as single csv lines, buffered by a process-wide `HistoryWriter` that flushes the lines of all
+bots together, and kept in a ring buffer for cheap access to the latest entries. Files stay readable by
+`utils.read_history`.
+"""
+import atexit
+import csv
+import io
+import os
+import threading
+import time
+from collections import deque, defaultdict
+import pandas as pd
+import config as cfg
+from utils import get_logger
+
+logger = get_logger('history')
+
+
+class HistoryWriter:
+    """
+    Buffers csv lines per file and writes them in batches. A batch is flushed when enough lines are pending, when the
+    oldest pending line is older than the flush interval, and at interpreter exit.
+    """
+
+    def __init__(self, flush_rows=None, flush_interval=None):
+        self.flush_rows = flush_rows or cfg.HISTORY_FLUSH_ROWS
+        self.flush_interval = flush_interval or cfg.HISTORY_FLUSH_SECONDS
+        self._pending = defaultdict(list)
+        self._n_pending = 0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='HistoryWriter', daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def write(self, filename, line):
+        with self._lock:
+            self._pending[filename].append(line)
+            self._n_pending += 1
+            full = self._n_pending >= self.flush_rows
+        if full:
+            self.flush()
+        else:
+            self._wakeup.set()
+
+    def flush(self, filename=None):
+        """
+        Writes pending lines to disk, of all files or of a single one.
+        """
+        with self._lock:
+            if filename is None:
+                pending, self._pending = self._pending, defaultdict(list)
+            else:
+                pending = {filename: self._pending.pop(filename, [])}
+            self._n_pending -= sum(len(lines) for lines in pending.values())
+            for fn, lines in pending.items():
+                if lines:
+                    with open(fn, 'a') as f:
+                        f.write(''.join(lines))
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            time.sleep(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer() -> HistoryWriter:
+    """
+    Process-wide writer shared by all history logs.
+    """
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = HistoryWriter()
+    return _writer
+
+
+class HistoryLog:
+    """
+    Append-only csv log of recommendation records with an in-memory ring buffer of the latest entries.
+    """
+
+    def __init__(self, filename, columns, maxlen=None, writer=None):
+        self.filename = filename
+        self.columns = list(columns)
+        self.writer = writer or get_writer()
+        self.recent_records = deque(maxlen=maxlen or cfg.HISTORY_RING_SIZE)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        if os.path.isfile(filename):
+            with open(filename, 'r') as f:
+                self._n_rows = max(sum(1 for _ in f) - 1, 0)
+        else:
+            self._n_rows = 0
+            self._write_row(['', *self.columns])
+            self.writer.flush(filename)
+
+    def _write_row(self, row):
+        buf = io.StringIO()
+        csv.writer(buf, lineterminator='\n').writerow(row)
+        self.writer.write(self.filename, buf.getvalue())
+
+    def append(self, record: dict):
+        """
+        Appends a single record, constant cost regardless of the log length.
+        """
+        self._write_row([self._n_rows, *[record.get(c) for c in self.columns]])
+        self._n_rows += 1
+        self.recent_records.append(dict(record))
+
+    def recent(self, n=None) -> pd.DataFrame:
+        """
+        Latest n records of this session from memory, without touching the disk.
+        """
+        records = list(self.recent_records)[-n:] if n else list(self.recent_records)
+        return pd.DataFrame(records, columns=self.columns)
+
+    def read(self) -> pd.DataFrame:
+        """
+        The complete log read from disk, after flushing pending records.
+        """
+        self.writer.flush(self.filename)
+        return pd.read_csv(self.filename, index_col=0, header=0)
@@ -0,0 +1,281 @@
+"""
+Pipeline metrics.
+
+Counters and histograms are looked up by name and labels, e.g.
+
+    metrics.counter('fetch_rows_appended_total', product=product_id).inc(n)
+    with metrics.timer('bot_decision_seconds', bot=bot_name, product=product_id):
+        ...
+
+When `cfg.METRICS_ENABLED` is False every lookup returns a shared no-op object, so an instrumented hot path costs one
+attribute check. When enabled, `start` exposes all metrics of the process as text on
+`http://localhost:<cfg.METRICS_PORTS[component]>/metrics` (JSON on `/metrics.json`) and dumps them as JSON under
+`cfg.PATH_DB_METRICS` every `cfg.METRICS_DUMP_SECONDS`.
+"""
+import bisect
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import config as cfg
+from utils import get_logger
+
+logger = get_logger('metrics')
+
+# upper bounds of the default histogram buckets: latencies in seconds.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# upper bounds of histogram buckets of row counts.
+ROW_BUCKETS = (0, 1, 10, 100, 300, 1000, 10000, 100000)
+
+
+class Counter:
+    """
+    Monotonic counter.
+    """
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, n=1):
+        with self._lock:
+            self.value += n
+
+    def snapshot(self):
+        return {'value': self.value}
+
+
+class Histogram:
+    """
+    Cumulative bucket counts, sum, count, min and max of observed values.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.
+        self.count = 0
+        self.min = None
+        self.max = None
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+            self.min = value if self.min is None else min(self.min, value)
+            self.max = value if self.max is None else max(self.max, value)
+
+    def time(self):
+        return _Timer(self)
+
+    def snapshot(self):
+        with self._lock:
+            cumulative, total = dict(), 0
+            for bound, n in zip([*self.buckets, '+Inf'], self.counts):
+                total += n
+                cumulative[str(bound)] = total
+            return {'count': self.count, 'sum': self.sum, 'min': self.min, 'max': self.max, 'buckets': cumulative}
+
+
+class _Timer:
+    """
+    Context manager observing its duration in seconds.
+    """
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+
+class _Null:
+    """
+    Stands in for every metric when metrics are disabled.
+    """
+
+    def inc(self, n=1):
+        pass
+
+    def observe(self, value):
+        pass
+
+    def time(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL = _Null()
+
+
+class MetricsRegistry:
+    """
+    All metrics of the process, keyed by name and labels.
+    """
+
+    def __init__(self):
+        self._metrics = dict()
+        self._lock = threading.Lock()
+
+    def get(self, kind, name, labels, **kwargs):
+        key = (name, tuple(sorted(labels.items())))
+        metric = self._metrics.get(key)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.setdefault(key, kind(**kwargs))
+        return metric
+
+    def snapshot(self) -> dict:
+        """
+        :return: dict of metric name to a list of {labels, type, values}.
+        """
+        out = dict()
+        for (name, labels), metric in sorted(self._metrics.items(), key=lambda kv: kv[0]):
+            out.setdefault(name, []).append({'labels': dict(labels), 'type': type(metric).__name__.lower(),
+                                             **metric.snapshot()})
+        return out
+
+    def text(self) -> str:
+        """
+        Plain text exposition, one line per counter value and per histogram bucket, sum and count.
+        """
+        lines = list()
+        for name, series in self.snapshot().items():
+            for s in series:
+                labels = [f'{k}="{v}"' for k, v in s['labels'].items()]
+                if s['type'] == 'counter':
+                    lines.append(f"{name}{_braces(labels)} {s['value']}")
+                    continue
+                for bound, n in s['buckets'].items():
+                    le = 'le="' + bound + '"'
+                    lines.append(f"{name}_bucket{_braces(labels + [le])} {n}")
+                lines.append(f"{name}_sum{_braces(labels)} {s['sum']}")
+                lines.append(f"{name}_count{_braces(labels)} {s['count']}")
+        return '\n'.join(lines) + '\n'
+
+
+def _braces(labels):
+    return '{' + ','.join(labels) + '}' if labels else ''
+
+
+_registry = MetricsRegistry()
+
+
+def counter(name, **labels) -> Counter:
+    if not cfg.METRICS_ENABLED:
+        return NULL
+    return _registry.get(Counter, name, labels)
+
+
+def histogram(name, buckets=LATENCY_BUCKETS, **labels) -> Histogram:
+    if not cfg.METRICS_ENABLED:
+        return NULL
+    return _registry.get(Histogram, name, labels, buckets=buckets)
+
+
+def timer(name, **labels):
+    """
+    Context manager recording its duration in the latency histogram name.
+    """
+    if not cfg.METRICS_ENABLED:
+        return NULL
+    return _registry.get(Histogram, name, labels).time()
+
+
+def snapshot() -> dict:
+    return _registry.snapshot()
+
+
+def text() -> str:
+    return _registry.text()
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            body, content_type = text().encode(), 'text/plain; charset=utf-8'
+        elif self.path == '/metrics.json':
+            body, content_type = json.dumps(snapshot()).encode(), 'application/json'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port):
+    """
+    Serves the metrics of this process over http from a daemon thread.
+    :return: the server, call shutdown() to stop it.
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', port), _Handler)
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    logger.info("Serving metrics on http://127.0.0.1:%s/metrics", server.server_address[1])
+    return server
+
+
+def dump(filename):
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    tmp = filename + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump({'time': time.time(), 'pid': os.getpid(), 'metrics': snapshot()}, f)
+    os.replace(tmp, filename)
+
+
+def start_dump(component, interval=None):
+    """
+    Dumps the metrics of this process to <cfg.PATH_DB_METRICS>/<component>.json every interval seconds from a daemon
+    thread.
+    :return: an event, set it to stop dumping.
+    """
+    filename = os.path.join(cfg.PATH_DB_METRICS, component + '.json')
+    interval = interval or cfg.METRICS_DUMP_SECONDS
+    stop = threading.Event()
+
+    def _run():
+        while not stop.wait(interval):
+            dump(filename)
+        dump(filename)
+
+    threading.Thread(target=_run, name='metrics-dump', daemon=True).start()
+    return stop
+
+
+def start(component, http=True):
+    """
+    Starts exposing metrics as configured, does nothing if metrics are disabled.
+    :param component: name of the dump file, e.g. 'fetcher'.
+    :param http: whether to serve them over http on cfg.METRICS_PORTS[component], if a port is configured. If the
+    port is taken, e.g. by another component, metrics are only dumped.
+    """
+    if not cfg.METRICS_ENABLED:
+        return
+    port = cfg.METRICS_PORTS.get(component)
+    if http and port:
+        try:
+            serve(port)
+        except OSError as e:
+            logger.error("Could not serve the metrics of %s on port %s, only dumping them: %s", component, port, e)
+    if cfg.METRICS_DUMP_SECONDS:
+        start_dump(component)
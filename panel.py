@@ -0,0 +1,132 @@
+"""
+Process-wide price panel.
+
+Every product is loaded once per process into growable arrays, and all bots of the process get read-only NumPy views
+of the same memory. When new candles are stored only the appended rows are read and written in place after the
+existing ones, so memory stays flat as more bot types run on a product.
+"""
+import threading
+import numpy as np
+from storage import get_store
+
+# columns held by the panel and their dtypes.
+PANEL_COLUMNS = {'epoch': np.int64, 'close': np.float64, 'volume': np.float64}
+
+
+class PriceSeries:
+    """
+    Growable arrays of one product. Capacity is doubled when full, so appends are amortized O(new rows).
+    """
+
+    def __init__(self, capacity=1024):
+        self._arrays = {c: np.empty(capacity, dtype=dtype) for c, dtype in PANEL_COLUMNS.items()}
+        self.n = 0
+
+    def __len__(self):
+        return self.n
+
+    def append(self, arrays: dict):
+        """
+        Appends rows (ascending epochs) newer than the last one, rows at or before it are ignored.
+        """
+        epoch = np.asarray(arrays['epoch'], dtype=np.int64)
+        start = 0 if self.n == 0 else int(np.searchsorted(epoch, self._arrays['epoch'][self.n - 1], side='right'))
+        k = len(epoch) - start
+        if k == 0:
+            return
+        if self.n + k > len(self._arrays['epoch']):
+            capacity = max(2 * len(self._arrays['epoch']), self.n + k)
+            for c, a in self._arrays.items():
+                grown = np.empty(capacity, dtype=a.dtype)
+                grown[:self.n] = a[:self.n]
+                self._arrays[c] = grown
+        for c, a in self._arrays.items():
+            a[self.n:self.n + k] = np.asarray(arrays[c], dtype=a.dtype)[start:]
+        self.n += k
+
+    def view(self, column) -> np.ndarray:
+        """
+        Read-only view of the first n rows of a column, no copy.
+        """
+        v = self._arrays[column][:self.n]
+        v.flags.writeable = False
+        return v
+
+    @property
+    def epoch(self):
+        return self.view('epoch')
+
+    @property
+    def close(self):
+        return self.view('close')
+
+    @property
+    def volume(self):
+        return self.view('volume')
+
+
+class PricePanel:
+    """
+    Loads each product once and keeps it up to date: a product is refreshed only when its stored file changed, by
+    reading just the appended rows if it only grew.
+    """
+
+    def __init__(self, store=None):
+        self.store = store or get_store()
+        self._series = dict()
+        self._states = dict()
+        self._positions = dict()
+        self._locks = dict()
+        self._lock = threading.Lock()
+
+    def _product_lock(self, product_id):
+        with self._lock:
+            return self._locks.setdefault(product_id, threading.Lock())
+
+    def get(self, product_id) -> PriceSeries:
+        """
+        Returns the up to date series of a product, None if it is not stored.
+        """
+        with self._product_lock(product_id):
+            state = self.store.state(product_id)
+            old = self._states.get(product_id)
+            series = self._series.get(product_id)
+            if series is not None and state == old:
+                return series
+            if series is not None and old is not None and state is not None \
+                    and state.inode == old.inode and state.size > old.size:
+                # the file has only grown, read the appended rows into the existing arrays.
+                tail, self._positions[product_id] = self.store.read_from(product_id, self._positions[product_id])
+                if tail is not None:
+                    series.append(_columns(tail))
+            else:
+                df, self._positions[product_id] = self.store.read_from(product_id, 0)
+                series = None
+                if df is not None:
+                    series = PriceSeries(capacity=max(2 * df.shape[0], 1024))
+                    series.append(_columns(df))
+                self._series[product_id] = series
+            self._states[product_id] = state
+            return series
+
+    def products(self):
+        return sorted(p for p, s in self._series.items() if s is not None)
+
+
+def _columns(df):
+    return {'epoch': df.index.values, 'close': df['close'].values, 'volume': df['volume'].values}
+
+
+_panel = None
+_panel_lock = threading.Lock()
+
+
+def get_panel() -> PricePanel:
+    """
+    The process-wide panel shared by all bots.
+    """
+    global _panel
+    with _panel_lock:
+        if _panel is None:
+            _panel = PricePanel()
+    return _panel
@@ -0,0 +1,44 @@
+"""
+Rate limiting primitives shared by concurrent fetchers.
+"""
+import asyncio
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Token bucket shared by fetchers running in one event loop or in several threads. Tokens are refilled continuously
+    at `rate` per second up to `capacity`; `acquire` waits until a token is available, `wait` is its blocking
+    counterpart for threads without an event loop.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = float(rate)
+        # the bucket must hold a whole token, otherwise rates below 1 per second would never grant one.
+        self.capacity = max(float(capacity or rate), 1.0)
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self, tokens: float) -> float:
+        """
+        Takes the tokens, going into debt if there are not enough, so that waiters are served in order.
+        :return: seconds to wait until the taken tokens are refilled.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= tokens
+            return max(0., -self._tokens / self.rate)
+
+    async def acquire(self, tokens: float = 1):
+        delay = self._reserve(tokens)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def wait(self, tokens: float = 1):
+        delay = self._reserve(tokens)
+        if delay > 0:
+            time.sleep(delay)
@@ -0,0 +1,208 @@
+"""
+Memoized features shared across bots.
+
+Bots declare the features they need as `FeatureSpec`s (name, product and parameters). The process-wide
+`FeatureRegistry` computes each distinct spec once per new candle, incrementally, and hands the same read-only result
+to every consumer, so that e.g. several MaBots with overlapping window lengths share their moving averages.
+
+Entries are kept in an LRU cache bounded by `cfg.FEATURE_CACHE_MAX_ENTRIES` and `cfg.FEATURE_CACHE_MAX_BYTES`. Each
+entry persists its values in the feature store (under the `_registry` bot name) together with its incremental state,
+so an evicted entry or a restarted process resumes from disk instead of replaying the history. An entry is
+recomputed from scratch when the product was rewritten (e.g. by `Fetcher.repair_gaps`), detected by the inode of the
+stored product recorded as the source of the stored values.
+"""
+import os
+import threading
+from collections import namedtuple, OrderedDict
+import numpy as np
+import pandas as pd
+import config as cfg
+from features import MovingAverageEngine
+from panel import get_panel
+from storage import FeatureStore
+from utils import get_logger
+
+logger = get_logger('registry')
+
+REGISTRY_BOT_NAME = '_registry'
+
+
+class FeatureSpec(namedtuple('FeatureSpec', ['name', 'product', 'params'])):
+    """
+    Hashable description of a feature: its name, product and sorted (key, value) parameter pairs.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def of(cls, name, product, **params):
+        return cls(name, product, tuple(sorted(params.items())))
+
+    @property
+    def key(self):
+        return self.name + ''.join(f'_{k}{v}' for k, v in self.params)
+
+
+def moving_average(window):
+    """
+    Incremental computation of the 'ma' feature: rolling mean of the close price over window samples.
+    """
+    return MovingAverageEngine({'value': window})
+
+
+class _Entry:
+    """
+    Cached values of one feature, in growable arrays, and the incremental computation producing them.
+    """
+
+    def __init__(self, spec, engine):
+        self.spec = spec
+        self.engine = engine
+        self.lock = threading.Lock()
+        self.epochs = np.empty(0, dtype=np.int64)
+        self.values = np.empty(0)
+        self.n = 0
+        self.source = None
+
+    def reset(self, engine):
+        """
+        Drops the values, in new arrays as series handed out before share the current ones.
+        """
+        self.engine = engine
+        self.epochs = np.empty(0, dtype=np.int64)
+        self.values = np.empty(0)
+        self.n = 0
+        self.source = None
+
+    @property
+    def nbytes(self):
+        return self.epochs.nbytes + self.values.nbytes
+
+    def extend(self, epochs, values):
+        k = len(epochs)
+        if self.n + k > len(self.epochs):
+            capacity = max(2 * len(self.epochs), self.n + k, 1024)
+            self.epochs = np.concatenate([self.epochs[:self.n], np.empty(capacity - self.n, dtype=np.int64)])
+            self.values = np.concatenate([self.values[:self.n], np.empty(capacity - self.n)])
+        self.epochs[self.n:self.n + k] = epochs
+        self.values[self.n:self.n + k] = values
+        self.n += k
+
+    def series(self) -> pd.Series:
+        epochs, values = self.epochs[:self.n], self.values[:self.n]
+        epochs.flags.writeable = False
+        values.flags.writeable = False
+        return pd.Series(values, index=pd.Index(epochs, name='epoch'), name=self.spec.key, copy=False)
+
+
+class FeatureRegistry:
+    """
+    LRU cache of feature entries, computing each distinct feature once per new candle.
+    """
+
+    def __init__(self, max_entries=None, max_bytes=None, panel=None, store=None):
+        self.max_entries = max_entries or cfg.FEATURE_CACHE_MAX_ENTRIES
+        self.max_bytes = max_bytes or cfg.FEATURE_CACHE_MAX_BYTES
+        self.panel = panel or get_panel()
+        self.store = store or FeatureStore()
+        self.factories = {'ma': moving_average}
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def register(self, name, factory):
+        """
+        Registers a feature computation: factory(**params) must return an object with the MovingAverageEngine
+        interface (update, save, load, last_epoch).
+        """
+        self.factories[name] = factory
+
+    def _state_filename(self, spec):
+        return os.path.join(self.store.filename(REGISTRY_BOT_NAME, self._table(spec)), 'state.npz')
+
+    @staticmethod
+    def _table(spec):
+        return os.path.join(spec.product, spec.key)
+
+    def _restore(self, spec) -> _Entry:
+        entry = _Entry(spec, self.factories[spec.name](**dict(spec.params)))
+        if entry.engine.load(self._state_filename(spec)):
+            df = self.store.read(REGISTRY_BOT_NAME, self._table(spec))
+            if df is not None and not df.empty and df.index.max() == entry.engine.last_epoch:
+                entry.extend(df.index.values, df.iloc[:, 0].values)
+                entry.source = self.store.source(REGISTRY_BOT_NAME, self._table(spec))
+                return entry
+            logger.info("Stored state of %s is stale, recomputing it.", spec)
+            entry.engine = self.factories[spec.name](**dict(spec.params))
+        return entry
+
+    def _entry(self, spec) -> _Entry:
+        with self._lock:
+            entry = self._entries.get(spec)
+            if entry is not None:
+                self._entries.move_to_end(spec)
+                self.hits += 1
+                return entry
+            self.misses += 1
+        entry = self._restore(spec)
+        with self._lock:
+            entry = self._entries.setdefault(spec, entry)
+            self._evict()
+        return entry
+
+    def _evict(self):
+        total = sum(e.nbytes for e in self._entries.values())
+        while len(self._entries) > 1 and (len(self._entries) > self.max_entries or total > self.max_bytes):
+            _, evicted = self._entries.popitem(last=False)
+            total -= evicted.nbytes
+            self.evictions += 1
+
+    def get(self, spec: FeatureSpec) -> pd.Series:
+        """
+        Returns the feature values up to the latest stored candle, computing only candles not seen before, or all of
+        them if the product was rewritten since the values were computed.
+        :return: read-only Series indexed by epoch, shared by all consumers of spec.
+        """
+        entry = self._entry(spec)
+        state = self.panel.store.state(spec.product)
+        source = state.inode if state is not None else None
+        with entry.lock:
+            series = self.panel.get(spec.product)
+            if series is None:
+                return entry.series()
+            if entry.source != source:
+                if entry.n:
+                    logger.info("%s was rewritten, recomputing %s.", spec.product, spec)
+                entry.reset(self.factories[spec.name](**dict(spec.params)))
+            epochs, close = series.epoch, series.close
+            last = entry.engine.last_epoch
+            if last is not None:
+                i = int(np.searchsorted(epochs, last, side='right'))
+                epochs, close = epochs[i:], close[i:]
+            if len(epochs):
+                new = entry.engine.update(epochs, close)
+                entry.extend(new.index.values, new['value'].values)
+                if last is None:
+                    self.store.write(REGISTRY_BOT_NAME, self._table(spec), new, source)
+                else:
+                    self.store.append(REGISTRY_BOT_NAME, self._table(spec), new)
+                entry.engine.save(self._state_filename(spec))
+                entry.source = source
+            result = entry.series()
+        with self._lock:
+            self._evict()
+        return result
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry() -> FeatureRegistry:
+    """
+    The process-wide registry shared by all bots.
+    """
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = FeatureRegistry()
+    return _registry
@@ -0,0 +1,125 @@
+"""
+Process-pool bot runner.
+
+Bots are sharded across worker processes so that pandas work, which mostly holds the GIL, runs on all cores. Products
+are distributed by the size of their stored data, each worker runs the bots of its shard with its own `Scheduler`
+and `TimeseriesWatcher`, and recommendations are sent back to the parent. Crashed workers are restarted with the
+same shard.
+"""
+import heapq
+import multiprocessing as mp
+import queue
+import time
+import config as cfg
+from storage import get_store
+from utils import get_logger, list_local_products
+
+
+def shard_products(products, n_shards, store=None):
+    """
+    Distributes products over n_shards with balanced total data size, largest products first.
+    :return: list of product lists.
+    """
+    store = store or get_store()
+    sizes = dict()
+    for p in products:
+        state = store.state(p)
+        sizes[p] = state.size if state is not None else 0
+    shards = [list() for _ in range(min(n_shards, len(products)) or 1)]
+    heap = [(0, i) for i in range(len(shards))]
+    for p in sorted(products, key=sizes.get, reverse=True):
+        load, i = heapq.heappop(heap)
+        shards[i].append(p)
+        heapq.heappush(heap, (load + sizes[p], i))
+    return shards
+
+
+def _worker(shard_id, bot_class, products, params, results):
+    """
+    Worker process: runs the bots of a shard until killed, sending every recommendation to the results queue.
+    """
+    import metrics
+    from scheduler import Scheduler, TimeseriesWatcher
+
+    def report(bot, epoch):
+        results.put((shard_id, bot.bot_name, bot.product, epoch, bot.rec_status))
+
+    metrics.start(f'{bot_class.__name__}-{shard_id}', http=False)
+    bots = [bot_class(product=p, **params) for p in products]
+    scheduler = Scheduler(bots, callback=report)
+    TimeseriesWatcher(scheduler.notify, scheduler.products).start()
+    scheduler.run()
+
+
+class BotRunner:
+    """
+    Runs one bot per product, sharded across worker processes.
+    """
+
+    def __init__(self, bot_class, products=None, workers=None, **params):
+        self.logger = get_logger('BotRunner')
+        self.bot_class = bot_class
+        self.params = params
+        self.products = products or list_local_products()
+        self.workers = workers or cfg.RUNNER_WORKERS or mp.cpu_count()
+        self.shards = shard_products(self.products, self.workers)
+        self.results = mp.Queue()
+        self.processes = dict()
+        self.recommendations = dict()  # (bot name, product) -> latest rec status.
+        self.restarts = 0
+
+    def _start(self, shard_id):
+        p = mp.Process(target=_worker, name=f'bots-{shard_id}',
+                       args=(shard_id, self.bot_class, self.shards[shard_id], self.params, self.results), daemon=True)
+        p.start()
+        self.processes[shard_id] = p
+        self.logger.info("Started worker %s (pid %s) with %s products.", shard_id, p.pid, len(self.shards[shard_id]))
+
+    def start(self):
+        for shard_id in range(len(self.shards)):
+            self._start(shard_id)
+
+    def check_workers(self):
+        """
+        Restarts workers that exited.
+        """
+        for shard_id, p in list(self.processes.items()):
+            if not p.is_alive():
+                self.logger.error("Worker %s (pid %s) exited with code %s, restarting it.", shard_id, p.pid, p.exitcode)
+                self.restarts += 1
+                time.sleep(cfg.RUNNER_RESTART_DELAY)
+                self._start(shard_id)
+
+    def collect(self, timeout=1.):
+        """
+        Collects the recommendations sent by workers within timeout.
+        :return: number of collected recommendations.
+        """
+        n = 0
+        deadline = time.time() + timeout
+        while True:
+            try:
+                shard_id, bot_name, product, epoch, rec_status = self.results.get(timeout=max(deadline - time.time(),
+                                                                                              0.))
+            except queue.Empty:
+                return n
+            self.recommendations[(bot_name, product)] = rec_status
+            self.logger.info("Worker %s: %s on %s at %s: %s.", shard_id, bot_name, product, epoch, rec_status)
+            n += 1
+
+    def stop(self):
+        for p in self.processes.values():
+            p.terminate()
+        for p in self.processes.values():
+            p.join()
+
+    def run(self):
+        self.logger.info("Running %s %s bots on %s workers.", len(self.products), self.bot_class.__name__,
+                         len(self.shards))
+        self.start()
+        try:
+            while True:
+                self.collect()
+                self.check_workers()
+        finally:
+            self.stop()
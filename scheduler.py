@@ -0,0 +1,144 @@
+"""
+Event-driven scheduling of bots.
+
+Instead of every bot sleeping for a full granularity period in its own thread, a single `Scheduler` receives
+"product X has new candles up to epoch T" notifications and dispatches only the bots of product X to a bounded worker
+pool. Notifications come either from a `Fetcher` in the same process (pass `scheduler.notify` as its `notify`
+argument) or from a `TimeseriesWatcher` polling the store for changes written by another process.
+"""
+import queue
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import config as cfg
+from storage import get_store
+from utils import get_logger
+
+
+class Scheduler:
+    """
+    Dispatches the bots of a product when new candles of that product arrive. Notifications of a product that arrive
+    while its bots are running are coalesced into one further dispatch.
+    """
+
+    def __init__(self, bots: list, workers=cfg.SCHEDULER_WORKERS, callback=None):
+        """
+        :param callback: optional callable(bot, epoch) called after each bot ran.
+        """
+        self.logger = get_logger('Scheduler')
+        self.callback = callback
+        self.bots = defaultdict(list)
+        for bot in bots:
+            self.bots[bot.product].append(bot)
+        self.workers = workers
+        self.queue = queue.Queue()
+        self._dispatched = dict()  # product -> last dispatched epoch.
+        self._pending = dict()  # product -> latest epoch notified while its bots were running.
+        self._running = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self.executor = None
+
+    @property
+    def products(self):
+        return sorted(self.bots)
+
+    def notify(self, product_id, epoch):
+        """
+        Thread-safe notification that product_id has new candles up to epoch.
+        """
+        self.queue.put((product_id, epoch))
+
+    def _submit(self, product_id, epoch):
+        with self._lock:
+            if product_id in self._running:
+                self._pending[product_id] = max(epoch, self._pending.get(product_id, epoch))
+                return
+            if epoch <= self._dispatched.get(product_id, -1):
+                return
+            self._running.add(product_id)
+            self._dispatched[product_id] = epoch
+        self.executor.submit(self._dispatch, product_id, epoch)
+
+    def _dispatch(self, product_id, epoch):
+        start_time = time.time()
+        for bot in self.bots[product_id]:
+            try:
+                bot.on_new_candles(epoch)
+                if self.callback is not None:
+                    self.callback(bot, epoch)
+            except Exception:
+                self.logger.exception("Bot %s failed on %s at %s.", bot.bot_name, product_id, epoch)
+        self.logger.debug("Dispatched %s bots of %s at %s in %.3f s.",
+                          len(self.bots[product_id]), product_id, epoch, time.time() - start_time)
+        with self._lock:
+            self._running.discard(product_id)
+            pending = self._pending.pop(product_id, None)
+        if pending is not None:
+            self._submit(product_id, pending)
+
+    def run(self):
+        """
+        Consumes notifications until stopped.
+        """
+        self.logger.info("Scheduling %s bots on %s products with %s workers.",
+                         sum(len(b) for b in self.bots.values()), len(self.bots), self.workers)
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='bot') as self.executor:
+            while not self._stop.is_set():
+                try:
+                    product_id, epoch = self.queue.get(timeout=1)
+                except queue.Empty:
+                    continue
+                if product_id not in self.bots or epoch is None:
+                    continue
+                self._submit(product_id, epoch)
+
+    def stop(self):
+        self._stop.set()
+
+
+class TimeseriesWatcher:
+    """
+    Polls the cheap change marker of each product in the store and notifies when it changed. Used when the fetcher
+    runs in another process.
+    """
+
+    def __init__(self, notify, products, interval=cfg.WATCH_INTERVAL, store=None):
+        self.logger = get_logger('TimeseriesWatcher')
+        self.notify = notify
+        self.products = list(products)
+        self.interval = interval
+        self.store = store or get_store()
+        self._states = dict()
+        self._stop = threading.Event()
+
+    def poll(self):
+        """
+        Checks all products once.
+        :return: number of changed products.
+        """
+        changed = 0
+        for product_id in self.products:
+            state = self.store.state(product_id)
+            if state is None or state == self._states.get(product_id):
+                continue
+            self._states[product_id] = state
+            self.notify(product_id, self.store.last_epoch(product_id))
+            changed += 1
+        return changed
+
+    def run(self):
+        while not self._stop.is_set():
+            changed = self.poll()
+            if changed:
+                self.logger.debug("%s products changed.", changed)
+            self._stop.wait(self.interval)
+
+    def start(self):
+        thread = threading.Thread(target=self.run, name='TimeseriesWatcher', daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self._stop.set()
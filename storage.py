@@ -0,0 +1,692 @@
+"""
+Storage backends for product timeseries.
+
+Two backends are available and selected with `cfg.TIMESERIES_BACKEND`:
+
+    csv      : the legacy one-csv-per-product layout under `db/timeseries/<product>.csv`.
+    columnar : one directory per product under `db/columnar/<product>/` holding one raw, fixed-width binary file per
+               column (int64 epoch, float64 OHLCV). Columns can be memory-mapped and appended to cheaply.
+
+Existing csv files are migrated to an empty columnar backend on its first use, or explicitly with
+`python storage.py`.
+
+Each stored product has a small json sidecar (`<product>.meta.json` next to a csv, `meta.json` inside a columnar
+directory) with its row count, last epoch, last valid epoch and gap count, kept in sync on every append and write, so
+`meta` answers where a product ends without reading it.
+
+Bot features are kept in an append-only `FeatureStore`, one columnar table per bot and product under
+`db/features/<bot>/<product>/`.
+"""
+import io
+import json
+import os
+import threading
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+import config as cfg
+import metrics
+from utils import get_logger, column_names
+
+logger = get_logger('storage')
+
+# dtype of each stored column. datetime is not stored, it is derived from epoch on read.
+TIMESERIES_DTYPES = {'epoch': '<i8', 'low': '<f8', 'high': '<f8', 'open': '<f8', 'close': '<f8', 'volume': '<f8'}
+
+# Cheap change marker of a stored product. size is the append position in backend units (bytes for csv, rows for
+# columnar), inode changes when a file is replaced rather than appended to.
+FileState = namedtuple('FileState', ['size', 'mtime_ns', 'inode'])
+
+
+class ProductMeta(namedtuple('ProductMeta', ['rows', 'last_epoch', 'last_valid', 'gaps'])):
+    """
+    Summary of a stored product: number of rows, epoch of the last row, epoch of the last row holding a real candle and
+    number of gaps between valid candles at `cfg.GRANULARITY` spacing. rows and gaps are None when the summary was
+    recovered from the tail of the product only.
+    """
+
+    @property
+    def placeholder(self):
+        """
+        Whether the last stored row is a placeholder of Nones.
+        """
+        return self.last_epoch is not None and self.last_epoch != self.last_valid
+
+    def extend(self, epochs, valid, granularity=cfg.GRANULARITY):
+        """
+        Summary after appending rows.
+        :param epochs: epochs of the appended rows, ascending.
+        :param valid: boolean mask of rows holding real candles.
+        """
+        epochs = np.asarray(epochs, dtype=np.int64)
+        if len(epochs) == 0:
+            return self
+        valid_epochs = epochs[np.asarray(valid, dtype=bool)]
+        if self.last_valid is not None:
+            valid_epochs = np.concatenate([[self.last_valid], valid_epochs[valid_epochs > self.last_valid]])
+        gaps = None if self.gaps is None else self.gaps + int((np.diff(valid_epochs) > granularity).sum())
+        return ProductMeta(None if self.rows is None else self.rows + len(epochs), int(epochs[-1]),
+                           int(valid_epochs[-1]) if len(valid_epochs) else self.last_valid, gaps)
+
+
+EMPTY_META = ProductMeta(0, None, None, 0)
+
+
+def _epochs_valid(df: pd.DataFrame):
+    """
+    Epochs and the valid mask of a timeseries DataFrame, with epoch either as a column or as index.
+    """
+    epochs = df['epoch'].values if 'epoch' in df.columns else df.index.values
+    return epochs, df['close'].notna().values
+
+
+class ColumnarTable:
+    """
+    A directory of fixed-width binary column files sharing a common row count.
+
+    Rows are appended to every column file; the number of rows is inferred from file sizes. If a write is interrupted
+    half way the shortest column wins, so a torn append is never visible to readers.
+    """
+
+    def __init__(self, path: str, dtypes: dict):
+        self.path = path
+        self.dtypes = {k: np.dtype(v) for k, v in dtypes.items()}
+
+    @property
+    def columns(self):
+        return list(self.dtypes.keys())
+
+    def filename(self, column):
+        return os.path.join(self.path, column + '.bin')
+
+    def exists(self):
+        return os.path.isfile(self.filename(self.columns[0]))
+
+    def __len__(self):
+        if not self.exists():
+            return 0
+        return min(os.path.getsize(self.filename(c)) // self.dtypes[c].itemsize
+                   if os.path.isfile(self.filename(c)) else 0
+                   for c in self.columns)
+
+    def state(self):
+        if not self.exists():
+            return None
+        st = os.stat(self.filename(self.columns[0]))
+        return FileState(len(self), st.st_mtime_ns, st.st_ino)
+
+    def column(self, name, mmap=True, start=0, stop=None):
+        """
+        Returns a read-only array of a column, memory-mapped by default.
+        :param start: first row to return.
+        :param stop: row after the last to return, defaults to the current row count.
+        """
+        n = len(self) if stop is None else stop
+        dtype = self.dtypes[name]
+        if n - start <= 0:
+            return np.empty(0, dtype=dtype)
+        if mmap:
+            return np.memmap(self.filename(name), dtype=dtype, mode='r', offset=start * dtype.itemsize,
+                             shape=(n - start,))
+        metrics.counter('storage_read_bytes_total', backend='columnar').inc((n - start) * dtype.itemsize)
+        with open(self.filename(name), 'rb') as f:
+            f.seek(start * dtype.itemsize)
+            return np.fromfile(f, dtype=dtype, count=n - start)
+
+    def read(self, columns=None, mmap=True, start=0):
+        """
+        :return: dict of column name to array, from row start on.
+        """
+        stop = len(self)
+        return {c: self.column(c, mmap=mmap, start=start, stop=stop) for c in (columns or self.columns)}
+
+    def append(self, data: dict):
+        """
+        Appends rows to all columns.
+        :param data: mapping of column name to a 1-D array-like. Missing values are written as NaN.
+        """
+        n = len(self)
+        os.makedirs(self.path, exist_ok=True)
+        for c in self.columns:
+            arr = np.asarray(data[c], dtype=self.dtypes[c])
+            with open(self.filename(c), 'ab') as f:
+                # truncate a possibly torn previous write before appending.
+                f.truncate(n * self.dtypes[c].itemsize)
+                f.write(arr.tobytes())
+            metrics.counter('storage_write_bytes_total', backend='columnar').inc(arr.nbytes)
+
+    def write(self, data: dict):
+        """
+        Replaces the whole table with data.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        for c in self.columns:
+            arr = np.asarray(data[c], dtype=self.dtypes[c])
+            tmp = self.filename(c) + '.tmp'
+            arr.tofile(tmp)
+            os.replace(tmp, self.filename(c))
+            metrics.counter('storage_write_bytes_total', backend='columnar').inc(arr.nbytes)
+
+
+class TimeseriesStore:
+    """
+    Base class for timeseries storage backends. Data frames exchanged with a store have the columns returned by
+    `utils.column_names`; frames returned by `read` are indexed by epoch.
+    """
+    name = None
+
+    def filename(self, product_id):
+        raise NotImplementedError
+
+    def exists(self, product_id):
+        return os.path.exists(self.filename(product_id))
+
+    def products(self):
+        raise NotImplementedError
+
+    def read(self, product_id):
+        raise NotImplementedError
+
+    def state(self, product_id) -> FileState:
+        """
+        Returns a cheap change marker for the stored product, None if it does not exist.
+        """
+        raise NotImplementedError
+
+    def last_epoch(self, product_id):
+        """
+        Epoch of the last stored row without reading the whole product, None if nothing is stored.
+        """
+        raise NotImplementedError
+
+    def tail(self, product_id, n):
+        """
+        Reads the last n stored rows only.
+        :return: df indexed by epoch, None if the product does not exist.
+        """
+        raise NotImplementedError
+
+    def read_from(self, product_id, position=0):
+        """
+        Reads rows stored from position on, where position is the value returned by a previous call (0 reads all).
+        :return: df indexed by epoch (None if nothing new) and the position to continue from.
+        """
+        raise NotImplementedError
+
+    def meta_filename(self, product_id):
+        raise NotImplementedError
+
+    def meta(self, product_id) -> ProductMeta:
+        """
+        Summary of the stored product from its sidecar. If the sidecar is missing or out of sync with the data, it is
+        recovered from the tail of the product, without rows and gaps.
+        :return: ProductMeta, None if the product does not exist.
+        """
+        state = self.state(product_id)
+        if state is None:
+            return None
+        meta = self._load_meta(product_id, state)
+        if meta is None:
+            logger.debug("Metadata of %s is missing or stale, reading its tail.", product_id)
+            meta = self._tail_meta(product_id)
+        return meta
+
+    def _load_meta(self, product_id, state):
+        try:
+            with open(self.meta_filename(product_id), 'r') as f:
+                d = json.load(f)
+        except FileNotFoundError:
+            return None
+        if d['granularity'] != cfg.GRANULARITY or d['position'] != state.size:
+            return None
+        return ProductMeta(d['rows'], d['last_epoch'], d['last_valid'], d['gaps'])
+
+    def _save_meta(self, product_id, meta: ProductMeta):
+        state = self.state(product_id)
+        filename = self.meta_filename(product_id)
+        tmp = filename + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'granularity': cfg.GRANULARITY, 'position': state.size if state is not None else None,
+                       **meta._asdict()}, f)
+        os.replace(tmp, filename)
+
+    def _tail_meta(self, product_id, n=1024):
+        """
+        Summary from the last rows, read backwards until a valid candle is found.
+        """
+        while True:
+            df = self.tail(product_id, n)
+            epochs, valid = _epochs_valid(df)
+            if valid.any() or len(df) < n:
+                break
+            n *= 8
+        if len(epochs) == 0:
+            return EMPTY_META
+        return ProductMeta(None, int(epochs[-1]), int(epochs[valid][-1]) if valid.any() else None, None)
+
+    def _synced_meta(self, product_id):
+        """
+        Summary of the stored product to extend on append, rebuilt with a full read if the sidecar is not in sync.
+        """
+        state = self.state(product_id)
+        if state is None:
+            return EMPTY_META
+        meta = self._load_meta(product_id, state)
+        if meta is None:
+            logger.info("Metadata of %s is missing or stale, rebuilding it.", product_id)
+            meta = EMPTY_META.extend(*_epochs_valid(self.read(product_id)))
+        return meta
+
+    def append(self, product_id, df: pd.DataFrame):
+        meta = self._synced_meta(product_id)
+        self._append(product_id, df)
+        self._save_meta(product_id, meta.extend(*_epochs_valid(df)))
+
+    def write(self, product_id, df: pd.DataFrame):
+        """
+        Replaces the stored product with df.
+        """
+        self._write(product_id, df)
+        self._save_meta(product_id, EMPTY_META.extend(*_epochs_valid(df)))
+
+    def _append(self, product_id, df: pd.DataFrame):
+        raise NotImplementedError
+
+    def _write(self, product_id, df: pd.DataFrame):
+        raise NotImplementedError
+
+    def merge(self, product_id, df: pd.DataFrame):
+        """
+        Inserts rows anywhere in the stored series, rows of df replace stored rows with the same epoch. This rewrites
+        the whole product and is meant for rare repairs, use `append` for new data.
+        """
+        new = df.set_index('epoch') if 'epoch' in df.columns else df
+        old = self.read(product_id)
+        both = new if old is None else pd.concat([old, new])
+        both = both[~both.index.duplicated(keep='last')].sort_index()
+        self.write(product_id, both)
+        return both
+
+
+class CsvStore(TimeseriesStore):
+    """
+    Legacy csv layout, one file per product.
+    """
+    name = 'csv'
+
+    def __init__(self, path=None):
+        self.path = path or cfg.PATH_DB_TIMESERIES
+
+    def filename(self, product_id):
+        return os.path.join(self.path, product_id) + '.csv'
+
+    def meta_filename(self, product_id):
+        return os.path.join(self.path, product_id) + '.meta.json'
+
+    def products(self):
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(f[:-4] for f in os.listdir(self.path) if f.endswith('.csv'))
+
+    def read(self, product_id):
+        filename = self.filename(product_id)
+        if os.path.exists(filename):
+            logger.info("Reading %s", filename)
+            metrics.counter('storage_read_bytes_total', backend='csv').inc(os.path.getsize(filename))
+            df = pd.read_csv(filename, index_col=0, header=0)
+            df.set_index('epoch', inplace=True)
+            return df
+        logger.info("Not found: %s", filename)
+        return None
+
+    def state(self, product_id):
+        try:
+            st = os.stat(self.filename(product_id))
+        except FileNotFoundError:
+            return None
+        return FileState(st.st_size, st.st_mtime_ns, st.st_ino)
+
+    def last_epoch(self, product_id):
+        filename = self.filename(product_id)
+        if not os.path.isfile(filename):
+            return None
+        with open(filename, 'rb') as f:
+            header = f.readline().decode().rstrip('\n').split(',')
+            # read backwards from the end until a complete last line is found.
+            size = f.seek(0, os.SEEK_END)
+            block = 1024
+            while True:
+                f.seek(max(size - block, 0))
+                lines = f.read().rstrip(b'\n').split(b'\n')
+                if len(lines) > 1 or block >= size:
+                    break
+                block *= 2
+        last = lines[-1].decode().split(',')
+        if last == header:
+            return None
+        return int(float(last[header.index('epoch')]))
+
+    def tail(self, product_id, n):
+        filename = self.filename(product_id)
+        if not os.path.isfile(filename):
+            return None
+        with open(filename, 'rb') as f:
+            header = f.readline()
+            first = f.tell()
+            size = f.seek(0, os.SEEK_END)
+            # read backwards from the end until n complete lines are found.
+            block = 128 * n
+            while True:
+                position = max(size - block, first)
+                f.seek(position)
+                chunk = f.read()
+                lines = chunk.rstrip(b'\n').split(b'\n')
+                if len(lines) > n or position == first:
+                    break
+                block *= 2
+        metrics.counter('storage_read_bytes_total', backend='csv').inc(len(chunk))
+        lines = [line for line in lines[-n:] if line]
+        df = pd.read_csv(io.BytesIO(header + b''.join(line + b'\n' for line in lines)), index_col=0, header=0)
+        df.set_index('epoch', inplace=True)
+        return df
+
+    def read_from(self, product_id, position=0):
+        filename = self.filename(product_id)
+        if position == 0:
+            # size is taken before reading, rows appended in between are read again by the next call.
+            size = os.path.getsize(filename) if os.path.exists(filename) else 0
+            return self.read(product_id), size
+        with open(filename, 'rb') as f:
+            header = f.readline().decode().rstrip('\n').split(',')
+            f.seek(position)
+            chunk = f.read()
+        # only consume complete lines, a concurrent append may be half written.
+        chunk = chunk[:chunk.rfind(b'\n') + 1]
+        if not chunk:
+            return None, position
+        logger.debug("Reading %s new bytes of %s", len(chunk), filename)
+        metrics.counter('storage_read_bytes_total', backend='csv').inc(len(chunk))
+        df = pd.read_csv(io.BytesIO(chunk), header=None, names=header, index_col=0)
+        df.set_index('epoch', inplace=True)
+        return df, position + len(chunk)
+
+    def _append(self, product_id, df: pd.DataFrame):
+        filename = self.filename(product_id)
+        os.makedirs(self.path, exist_ok=True)
+        text = df.to_csv(header=not os.path.isfile(filename), index=True)
+        with open(filename, 'a') as f:
+            f.write(text)
+        metrics.counter('storage_write_bytes_total', backend='csv').inc(len(text))
+
+    def _write(self, product_id, df: pd.DataFrame):
+        filename = self.filename(product_id)
+        os.makedirs(self.path, exist_ok=True)
+        if 'epoch' not in df.columns:
+            df = df.reset_index()
+        df.reset_index(drop=True).to_csv(filename + '.tmp', index=True)
+        metrics.counter('storage_write_bytes_total', backend='csv').inc(os.path.getsize(filename + '.tmp'))
+        os.replace(filename + '.tmp', filename)
+
+
+class ColumnarStore(TimeseriesStore):
+    """
+    Typed binary columnar layout, one directory per product with one file per column.
+    """
+    name = 'columnar'
+
+    def __init__(self, path=None):
+        self.path = path or cfg.PATH_DB_COLUMNAR
+
+    def filename(self, product_id):
+        return os.path.join(self.path, product_id)
+
+    def table(self, product_id) -> ColumnarTable:
+        return ColumnarTable(self.filename(product_id), TIMESERIES_DTYPES)
+
+    def meta_filename(self, product_id):
+        return os.path.join(self.filename(product_id), 'meta.json')
+
+    def exists(self, product_id):
+        return self.table(product_id).exists()
+
+    def products(self):
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(p for p in os.listdir(self.path) if self.exists(p))
+
+    def columns(self, product_id, columns=None, mmap=True):
+        """
+        Raw access to the stored arrays without building a DataFrame.
+        :return: dict of column name to (memory-mapped) array.
+        """
+        return self.table(product_id).read(columns, mmap=mmap)
+
+    def read(self, product_id):
+        if not self.exists(product_id):
+            logger.info("Not found: %s", self.filename(product_id))
+            return None
+        logger.info("Reading %s", self.filename(product_id))
+        arrays = self.columns(product_id, mmap=False)
+        return to_frame(arrays)
+
+    def state(self, product_id):
+        return self.table(product_id).state()
+
+    def last_epoch(self, product_id):
+        epoch = self.table(product_id).column('epoch')
+        return int(epoch[-1]) if len(epoch) else None
+
+    def tail(self, product_id, n):
+        table = self.table(product_id)
+        if not table.exists():
+            return None
+        return to_frame(table.read(mmap=False, start=max(len(table) - n, 0)))
+
+    def read_from(self, product_id, position=0):
+        if position == 0:
+            df = self.read(product_id)
+            return df, (len(df) if df is not None else 0)
+        arrays = self.table(product_id).read(mmap=False, start=position)
+        n = len(arrays['epoch'])
+        if n == 0:
+            return None, position
+        logger.debug("Reading %s new rows of %s", n, self.filename(product_id))
+        return to_frame(arrays), position + n
+
+    def _append(self, product_id, df: pd.DataFrame):
+        self.table(product_id).append(from_frame(df))
+
+    def _write(self, product_id, df: pd.DataFrame):
+        self.table(product_id).write(from_frame(df))
+
+
+def to_frame(arrays: dict) -> pd.DataFrame:
+    """
+    Builds a timeseries DataFrame indexed by epoch from stored column arrays.
+    """
+    epoch = pd.Index(np.asarray(arrays['epoch']), name='epoch')
+    df = pd.DataFrame({c: np.asarray(arrays[c]) for c in column_names()[1:-1]}, index=epoch)
+    df['datetime'] = pd.to_datetime(epoch, unit='s', utc=True)
+    return df
+
+
+def from_frame(df: pd.DataFrame) -> dict:
+    """
+    Converts a timeseries DataFrame, with epoch either as a column or as index, to column arrays.
+    """
+    if 'epoch' not in df.columns:
+        df = df.reset_index()
+    return {c: pd.to_numeric(df[c], errors='coerce').to_numpy() for c in TIMESERIES_DTYPES}
+
+
+class FeatureStore:
+    """
+    Append-only store of bot features keyed by epoch, one columnar table per bot and product.
+
+    Only rows newer than the last persisted epoch are written, so the cost of a write is proportional to the number of
+    new rows. Time ranges are read by binary search on the memory-mapped epoch column.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or cfg.PATH_DB_FEATURE
+
+    def filename(self, bot_name, product_id):
+        return os.path.join(self.path, bot_name, product_id)
+
+    def _schema_filename(self, bot_name, product_id):
+        return os.path.join(self.filename(bot_name, product_id), 'columns.json')
+
+    def _source_filename(self, bot_name, product_id):
+        return os.path.join(self.filename(bot_name, product_id), 'source.json')
+
+    def source(self, bot_name, product_id):
+        """
+        :return: marker of the data the stored features were computed from (see `write`), None if unknown.
+        """
+        try:
+            with open(self._source_filename(bot_name, product_id), 'r') as f:
+                return json.load(f)['source']
+        except FileNotFoundError:
+            return None
+
+    def columns(self, bot_name, product_id):
+        """
+        :return: stored feature column names, None if nothing is stored yet.
+        """
+        try:
+            with open(self._schema_filename(bot_name, product_id), 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def table(self, bot_name, product_id, columns=None) -> ColumnarTable:
+        columns = columns or self.columns(bot_name, product_id) or []
+        dtypes = {'epoch': '<i8', **{c: '<f8' for c in columns}}
+        return ColumnarTable(self.filename(bot_name, product_id), dtypes)
+
+    def last_epoch(self, bot_name, product_id):
+        """
+        :return: the latest stored epoch, None if nothing is stored yet.
+        """
+        epoch = self.table(bot_name, product_id).column('epoch')
+        return int(epoch[-1]) if len(epoch) else None
+
+    def write(self, bot_name, product_id, df: pd.DataFrame, source=None):
+        """
+        Replaces the stored features with df (indexed by epoch).
+        :param source: marker of the data df was computed from, e.g. the inode of the stored product (see
+        `TimeseriesStore.state`), which changes when the product is rewritten by a gap repair.
+        :return: number of rows written.
+        """
+        columns = [str(c) for c in df.columns]
+        table = self.table(bot_name, product_id, columns)
+        table.write({'epoch': df.index.values, **{c: df[k].values for c, k in zip(columns, df.columns)}})
+        with open(self._schema_filename(bot_name, product_id), 'w') as f:
+            json.dump(columns, f)
+        with open(self._source_filename(bot_name, product_id), 'w') as f:
+            json.dump({'source': source}, f)
+        return len(df)
+
+    def append(self, bot_name, product_id, df: pd.DataFrame, source=None):
+        """
+        Persists the rows of df (indexed by epoch) that are newer than the last stored epoch. If the feature columns or
+        the source (see `write`) changed, the stored features are replaced by df, which then must hold all rows.
+        :return: number of rows written.
+        """
+        columns = [str(c) for c in df.columns]
+        if columns != self.columns(bot_name, product_id):
+            logger.info("Feature columns of %s/%s changed to %s, rewriting the store.", bot_name, product_id, columns)
+            return self.write(bot_name, product_id, df, source)
+        if source is not None and source != self.source(bot_name, product_id):
+            logger.info("Features of %s/%s were computed from other data, rewriting the store.", bot_name, product_id)
+            return self.write(bot_name, product_id, df, source)
+        last_epoch = self.last_epoch(bot_name, product_id)
+        if last_epoch is not None:
+            df = df.loc[df.index > last_epoch]
+        if df.empty:
+            return 0
+        table = self.table(bot_name, product_id, columns)
+        table.append({'epoch': df.index.values, **{c: df[k].values for c, k in zip(columns, df.columns)}})
+        return len(df)
+
+    def read(self, bot_name, product_id, start=None, stop=None):
+        """
+        Reads features with start <= epoch <= stop, without loading rows outside the range.
+        :return: df indexed by epoch, None if nothing is stored.
+        """
+        columns = self.columns(bot_name, product_id)
+        if columns is None:
+            return None
+        table = self.table(bot_name, product_id, columns)
+        epoch = table.column('epoch')
+        i0 = 0 if start is None else int(np.searchsorted(epoch, start, side='left'))
+        i1 = len(epoch) if stop is None else int(np.searchsorted(epoch, stop, side='right'))
+        index = pd.Index(np.array(epoch[i0:i1]), name='epoch')
+        return pd.DataFrame({c: table.column(c, mmap=False, start=i0, stop=i1) for c in columns}, index=index,
+                            columns=columns)
+
+    def tail(self, bot_name, product_id, n):
+        """
+        Reads the last n stored feature rows only.
+        :return: df indexed by epoch, None if nothing is stored.
+        """
+        columns = self.columns(bot_name, product_id)
+        if columns is None:
+            return None
+        table = self.table(bot_name, product_id, columns)
+        stop = len(table)
+        start = max(stop - n, 0)
+        index = pd.Index(table.column('epoch', mmap=False, start=start, stop=stop), name='epoch')
+        return pd.DataFrame({c: table.column(c, mmap=False, start=start, stop=stop) for c in columns}, index=index,
+                            columns=columns)
+
+
+_stores = dict()
+_stores_lock = threading.RLock()
+
+
+def get_store(backend=None) -> TimeseriesStore:
+    """
+    Returns the timeseries store for a backend name, defaults to `cfg.TIMESERIES_BACKEND`. An empty columnar store is
+    filled with the existing csv timeseries on first use, so that switching the backend does not hide them.
+    """
+    backend = backend or cfg.TIMESERIES_BACKEND
+    with _stores_lock:
+        if backend not in _stores:
+            if backend == CsvStore.name:
+                _stores[backend] = CsvStore()
+            elif backend == ColumnarStore.name:
+                _stores[backend] = ColumnarStore()
+                if not _stores[backend].products() and get_store(CsvStore.name).products():
+                    logger.info("The columnar store is empty, migrating the csv timeseries to it.")
+                    migrate(source=CsvStore.name, target=ColumnarStore.name)
+            else:
+                raise ValueError(f"Unknown timeseries backend {backend}.")
+        return _stores[backend]
+
+
+def migrate(products=None, source='csv', target='columnar'):
+    """
+    One-shot copy of all (or given) products from a source backend to a target backend. Products already present in
+    the target are skipped.
+    :return: list of migrated product names.
+    """
+    src, dst = get_store(source), get_store(target)
+    migrated = list()
+    for product_id in products or src.products():
+        if dst.exists(product_id):
+            logger.info("%s already exists in %s store, skipping.", product_id, target)
+            continue
+        df = src.read(product_id)
+        if df is None:
+            continue
+        df = df[~df.index.duplicated(keep='last')].sort_index()
+        # write replaces the product, so that processes migrating at the same time do not duplicate rows.
+        dst.write(product_id, df)
+        logger.info("Migrated %s with %s rows from %s to %s.", product_id, df.shape[0], source, target)
+        migrated.append(product_id)
+    return migrated
+
+
+if __name__ == '__main__':
+    migrate()
@@ -0,0 +1,102 @@
+"""
+Multi-core parameter sweep of MaBot window lengths over all local products.
+
+Every product's close prices are handed to the worker processes as a memory-mapped file (the column file of the
+columnar store, or a temporary copy for the csv store), so workers share the page cache instead of receiving copies.
+Each worker computes one cumulative sum per product and derives the moving averages of all window lengths from it.
+"""
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product as cartesian
+import numpy as np
+import pandas as pd
+import config as cfg
+from backtest import simulate, summary
+from features import rolling_means
+from storage import get_store, ColumnarStore, TIMESERIES_DTYPES
+from utils import get_logger, list_local_products
+
+logger = get_logger('sweep')
+
+# MaBot window lengths are given in days of 15 minute samples.
+SAMPLES_PER_WINDOW_UNIT = 4 * 24
+
+
+def window_pairs(small=(1, 3, 7, 14, 30), large=(30, 60, 90, 120)):
+    """
+    Grid of (small, large) window lengths with small < large.
+    """
+    return [(s, l) for s, l in cartesian(small, large) if s < l]
+
+
+def _sweep_product(product_id, filename, n_rows, pairs):
+    """
+    Worker: backtests all window pairs on one product.
+    """
+    values = np.memmap(filename, dtype=TIMESERIES_DTYPES['close'], mode='r', shape=(n_rows,))
+    windows = sorted({w for pair in pairs for w in pair})
+    means = rolling_means(values, [SAMPLES_PER_WINDOW_UNIT * w for w in windows])
+    rows = list()
+    for s, l in pairs:
+        small, large = means[SAMPLES_PER_WINDOW_UNIT * s], means[SAMPLES_PER_WINDOW_UNIT * l]
+        # same rule as MaBot.decision_fun: Buy when the small window average is above the large one.
+        signal = np.where(large < small, 1., np.where(large > small, 0., np.nan))
+        position, returns, _, equity = simulate(values, signal)
+        rows.append({'product': product_id, 'small': s, 'large': l, **summary(position, returns, equity)})
+    return rows
+
+
+def _price_files(products, tmpdir):
+    """
+    Memory-mappable close price file and row count of each product.
+    """
+    store = get_store()
+    files = dict()
+    for p in products:
+        if isinstance(store, ColumnarStore):
+            table = store.table(p)
+            files[p] = (table.filename('close'), len(table))
+        else:
+            df = store.read(p)
+            if df is None:
+                continue
+            filename = os.path.join(tmpdir, p + '.bin')
+            df['close'].to_numpy(dtype=TIMESERIES_DTYPES['close']).tofile(filename)
+            files[p] = (filename, df.shape[0])
+    return {p: f for p, f in files.items() if f[1] > 0}
+
+
+def sweep(pairs=None, products=None, workers=None):
+    """
+    Evaluates window pairs on all (or given) local products with a process pool.
+    :return: ranked table of window pairs aggregated over products, and the per product results.
+    """
+    pairs = pairs or window_pairs()
+    products = products or list_local_products()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        files = _price_files(products, tmpdir)
+        logger.info("Sweeping %s window pairs over %s products.", len(pairs), len(files))
+        # largest products first, so that they do not end up last on a single worker.
+        order = sorted(files, key=lambda p: files[p][1], reverse=True)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_sweep_product, p, *files[p], pairs) for p in order]
+            results = pd.DataFrame([row for f in futures for row in f.result()])
+    if results.empty:
+        return results, results
+    ranked = results.groupby(['small', 'large']).agg(strategy_return=('strategy_return', 'mean'),
+                                                     median_strategy_return=('strategy_return', 'median'),
+                                                     hodl_return=('hodl_return', 'mean'),
+                                                     trades=('trades', 'mean'),
+                                                     products=('product', 'count'))
+    ranked = ranked.sort_values('strategy_return', ascending=False).reset_index()
+    ranked.index = pd.RangeIndex(1, len(ranked) + 1, name='rank')
+    return ranked, results
+
+
+if __name__ == '__main__':
+    ranked_, results_ = sweep()
+    os.makedirs(cfg.PATH_DB_SWEEPS, exist_ok=True)
+    ranked_.to_csv(os.path.join(cfg.PATH_DB_SWEEPS, 'MaBot_ranked.csv'))
+    results_.to_csv(os.path.join(cfg.PATH_DB_SWEEPS, 'MaBot_results.csv'))
+    print(ranked_.head(20).to_string())
@@ -0,0 +1,30 @@
+"""
+Tests run against a temporary local db, with the stub exchange client of the benchmarks instead of Coinbase.
+"""
+import os
+import pytest
+from benchmarks.common import configure, reset
+
+_db = configure()
+
+
+@pytest.fixture(autouse=True, scope='session')
+def _workdir():
+    """
+    Log files are written relative to the working directory, keep them in the temporary db.
+    """
+    cwd = os.getcwd()
+    os.chdir(_db)
+    yield
+    os.chdir(cwd)
+
+
+@pytest.fixture
+def db(tmp_path):
+    """
+    A fresh, empty local db.
+    """
+    configure(str(tmp_path))
+    reset()
+    yield tmp_path
+    reset()
@@ -0,0 +1,31 @@
+import numpy as np
+import pandas as pd
+import pytest
+from benchmarks.synthetic import populate
+from bots.Bot import MaBot
+from storage import get_store
+
+PRODUCT = 'SYN0-EUR'
+
+
+def placeholder(store, product):
+    """
+    Appends a candle of Nones, as stored for windows the exchange has no data for.
+    """
+    epoch = store.meta(product).last_epoch + 3600
+    store.append(product, pd.DataFrame({c: [np.nan] for c in ['low', 'high', 'open', 'close', 'volume']},
+                                       index=pd.Index([epoch], name='epoch')))
+
+
+@pytest.mark.parametrize('days, missing', [(45, False), (200, False), (200, True)])
+def test_ma_decision_agrees_with_signal(db, days, missing):
+    # the large window of 30 days, in samples, needs 120 days of hourly candles.
+    populate([PRODUCT], days / 365.25, get_store())
+    bot = MaBot(PRODUCT, window_length=[10, 30])
+    bot.decision()
+    if missing:
+        placeholder(get_store(), PRODUCT)
+    expected = MaBot.signal_fun(bot.value, **bot.params).values[-1]
+    expected = None if pd.isna(expected) else expected
+    assert bot.decision() == expected
+    assert (expected is None) == (days < 120 or missing)
@@ -0,0 +1,49 @@
+import asyncio
+import datetime
+import time
+import requests
+from benchmarks.stub import StubClient
+from Fetcher import FetcherArmy
+from storage import get_store
+
+PRODUCT = 'SYN0-EUR'
+
+
+class FlakyClient(StubClient):
+    """
+    Raises a connection error on the first `failures` requests.
+    """
+
+    def __init__(self, failures, **kwargs):
+        super().__init__(**kwargs)
+        self.failures = failures
+
+    def get_product_historic_rates(self, *args, **kwargs):
+        with self._lock:
+            self.failures -= 1
+            fail = self.failures >= 0
+        if fail:
+            raise requests.ConnectionError("connection reset")
+        return super().get_product_historic_rates(*args, **kwargs)
+
+
+def army(client):
+    army = FetcherArmy([PRODUCT], client=client)
+    for soldier in army.army:
+        soldier.start_year = datetime.date.today().year
+    return army
+
+
+def test_fetch_all_async_retries_client_exceptions(db):
+    client = FlakyClient(failures=2, products=[PRODUCT])
+    asyncio.run(army(client).fetch_all_async(rate=1000, retries=3, backoff=0))
+    assert get_store().meta(PRODUCT).last_valid == int(client._series(PRODUCT)[-1, 0])
+
+
+def test_timeout_bounds_the_cycle(db):
+    client = StubClient(products=[PRODUCT], latency=2)
+    start = time.monotonic()
+    asyncio.run(army(client).fetch_all_async(timeout=0.2, retries=0))
+    # the abandoned request does not hold up the end of the cycle.
+    assert time.monotonic() - start < 1
+    assert get_store().meta(PRODUCT) is None
@@ -0,0 +1,24 @@
+import asyncio
+import time
+from threading import Thread
+from ratelimit import TokenBucket
+
+
+def test_rate_below_one_grants_tokens():
+    limiter = TokenBucket(0.5)
+    start = time.monotonic()
+    asyncio.run(asyncio.wait_for(limiter.acquire(), 1))
+    limiter.wait()
+    assert 1.5 < time.monotonic() - start < 3
+
+
+def test_shared_between_threads():
+    limiter = TokenBucket(10, capacity=1)
+    start = time.monotonic()
+    threads = [Thread(target=lambda: asyncio.run(limiter.acquire())) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # the first token is in the bucket, the other 5 are refilled at 10 per second.
+    assert time.monotonic() - start >= 0.45
@@ -0,0 +1,25 @@
+import numpy as np
+from benchmarks.synthetic import product_ids, populate
+from bots.Bot import MaBot
+from storage import get_store
+import visuals
+
+
+def test_rank_products_from_feature_tails(db):
+    products = product_ids(4)
+    populate(products, 1, get_store())
+    bots = [MaBot(p, window_length=[10, 30]) for p in products]
+    for bot in bots:
+        bot.update_rec()
+    rows = 24 * 60
+    ranking = visuals.rank_products(products, bots[0].key, rows=rows)
+    assert list(ranking['score']) == sorted(ranking['score'], reverse=True)
+    for bot in bots:
+        features = bot.features
+        small, large = features[10].values[-1], features[30].values[-1]
+        assert np.isclose(ranking.loc[bot.product, 'distance'], (small - large) / large)
+        assert ranking.loc[bot.product, 'rec'] == bot.decision()
+        last = bot._crossovers.last_event()
+        crossed = last is not None and last['epoch'] >= features.index[-rows]
+        age = int((features.index >= last['epoch']).sum()) - 1 if crossed else rows
+        assert ranking.loc[bot.product, 'age'] == age
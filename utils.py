@@ -1,41 +1,146 @@
+import atexit
+import json
 import logging
-import yaml
-import cbpro
-import pandas as pd
+import logging.handlers
+import queue
+import threading
 import os
 import config as cfg
-from pathlib import Path
 import datetime
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from math import floor
 from time import time
 
+# pandas, cbpro and yaml are imported where they are used, so that importing utils (and the cli) stays cheap.
 
-pd.set_option('display.max_columns', None)
-pd.set_option('display.max_rows', 500)
-pd.set_option('display.max_columns', 500)
-pd.set_option('display.width', 1000)
+
+def set_display_options():
+    """
+    Wide pandas display, for data frames printed to the console and the logs.
+    """
+    import pandas as pd
+    pd.set_option('display.max_columns', None)
+    pd.set_option('display.max_rows', 500)
+    pd.set_option('display.max_columns', 500)
+    pd.set_option('display.width', 1000)
+
+
+_log_queue = queue.Queue(-1)
+_log_listener = None
+_log_lock = threading.Lock()
+_log_forked = False
+
+
+class _FileRouter(logging.Handler):
+    """
+    Writes each record to log/<logger name>.log, opening the file on its first record.
+    """
+
+    def __init__(self, directory='log'):
+        super().__init__()
+        self.directory = directory
+        self._handlers = dict()
+
+    def setFormatter(self, fmt):
+        super().setFormatter(fmt)
+        for handler in self._handlers.values():
+            handler.setFormatter(fmt)
+
+    def emit(self, record):
+        handler = self._handlers.get(record.name)
+        if handler is None:
+            os.makedirs(self.directory, exist_ok=True)
+            handler = logging.FileHandler(os.path.join(self.directory, f'{record.name}.log'))
+            handler.setFormatter(self.formatter)
+            self._handlers[record.name] = handler
+        handler.emit(record)
+
+    def close(self):
+        for handler in self._handlers.values():
+            handler.close()
+        super().close()
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to the queue of the current process, starting its writer thread if needed.
+    """
+
+    def enqueue(self, record):
+        if _log_listener is None:
+            _start_log_listener()
+        _log_queue.put_nowait(record)
+
+
+def _start_log_listener():
+    """
+    Starts the single background thread writing all queued log records to the console and the log files.
+    """
+    global _log_listener
+    with _log_lock:
+        if _log_listener is not None:
+            return
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+        console, files = logging.StreamHandler(), _FileRouter()
+        console.setFormatter(formatter)
+        files.setFormatter(formatter)
+        _log_listener = logging.handlers.QueueListener(_log_queue, console, files)
+        _log_listener.start()
+        atexit.register(_stop_log_listener)
+        if _log_forked:
+            # forked multiprocessing workers leave through os._exit, which skips atexit.
+            from multiprocessing.util import Finalize
+            Finalize(None, _stop_log_listener, exitpriority=0)
+
+
+def _stop_log_listener():
+    """
+    Writes the records still in the queue and stops the writer thread.
+    """
+    global _log_listener
+    with _log_lock:
+        if _log_listener is None:
+            return
+        _log_listener.stop()
+        for handler in _log_listener.handlers:
+            handler.close()
+        _log_listener = None
+
+
+def _after_fork_in_child():
+    """
+    The writer thread does not survive a fork. The child drops the queue and the lock inherited from its parent, whose
+    records the parent writes itself, and its loggers start a writer of its own on their next record.
+    """
+    global _log_queue, _log_listener, _log_lock, _log_forked
+    _log_queue, _log_listener, _log_lock, _log_forked = queue.Queue(-1), None, threading.Lock(), True
+
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def log_level(name):
+    """
+    Level of a logger from cfg.LOG_LEVELS, looked up by its full name and then by its component, the part after the
+    last underscore (e.g. 'Fetcher' for 'BTC-EUR_Fetcher'), falling back to cfg.LOG_LEVEL.
+    """
+    levels = cfg.LOG_LEVELS
+    level = levels.get(name, levels.get(name.rsplit('_', 1)[-1], cfg.LOG_LEVEL))
+    return logging.getLevelName(level) if isinstance(level, str) else level
 
 
 def get_logger(name):
-    # create logger
+    """
+    Returns the logger name, set up once to hand its records to the background writer through a queue, so logging
+    never blocks the caller on console or file io. Calling it again returns the same logger without new handlers.
+    """
     logger_ = logging.getLogger(name)
-    logger_.setLevel(logging.DEBUG)
-    # create formatter
-    fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-    formatter = logging.Formatter(fmt)
-    # create console handler and set level to debug and add formatter to ch
-    ch = logging.StreamHandler()
-    ch.setLevel(logging.DEBUG)
-    ch.setFormatter(formatter)
-    # add ch to logger
-    logger_.addHandler(ch)
-    # do the same with a file handler.
-    if not os.path.exists('log'):
-        os.makedirs('log')
-    f_handler = logging.FileHandler(os.path.join('log', f'{name}.log'))
-    f_handler.setLevel(logging.DEBUG)
-    f_handler.setFormatter(formatter)
-    logger_.addHandler(f_handler)
+    logger_.setLevel(log_level(name))
+    if not any(isinstance(h, _QueueHandler) for h in logger_.handlers):
+        logger_.addHandler(_QueueHandler(_log_queue))
+        logger_.propagate = False
+    _start_log_listener()
     return logger_
 
 
@@ -47,29 +152,55 @@ def list_local_products():
     Returns locally available product names.
     :return:
     """
-    all_files = list(os.walk(cfg.PATH_DB_TIMESERIES, topdown=False))[0][-1]
-    all_files = sorted(all_files)
-    return [Path(f).stem for f in all_files]
+    from storage import get_store
+    return get_store().products()
+
+
+def product_catalogue(ttl=None) -> list:
+    """
+    Products listed by cb, as returned by get_products. The catalogue is cached in cfg.PATH_DB_PRODUCTS and only
+    fetched again once it is older than ttl seconds.
+    :param ttl: defaults to cfg.PRODUCTS_TTL.
+    :return: list of product dicts.
+    """
+    ttl = cfg.PRODUCTS_TTL if ttl is None else ttl
+    filename = cfg.PATH_DB_PRODUCTS
+    cached = None
+    if os.path.isfile(filename):
+        with open(filename, 'r') as f:
+            cached = json.load(f)
+        if time() - os.path.getmtime(filename) < ttl:
+            return cached
+    logger.debug('Fetching all product names.')
+    products = get_client().get_products()
+    if not isinstance(products, list):
+        if cached is None:
+            raise RuntimeError(f"Could not get the product catalogue, instead got this: {products}")
+        logger.warning("Could not refresh the product catalogue, using the cached one: %s", products)
+        return cached
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename + '.tmp', 'w') as f:
+        json.dump(products, f)
+    os.replace(filename + '.tmp', filename)
+    return products
 
 
 def product_list(denominated_in: tuple = ("EUR",)) -> list:
     """
-    Fetches cb product names with a given currency denomination.
-    Wraps auth_client's get_products methods.
+    Cb product names with a given currency denomination, from the cached product catalogue.
     :return:
     a list of product names.
     """
-    logger.debug('Fetching all product names.')
-    auth_client = get_client()
-    df = pd.DataFrame(auth_client.get_products())
+    import pandas as pd
+    df = pd.DataFrame(product_catalogue())
     logger.debug(df.iloc[:, :2].head())
     # select coins with a given currency.
     i = df['quote_currency'].isin(list(denominated_in))
-    logger.debug(f"Found {sum(i)} matching currencies.")
+    logger.debug("Found %s matching currencies.", sum(i))
     df = df.loc[i]
     df.reset_index(drop=True, inplace=True)
-    logger.debug('\n' + df.iloc[:, :2].head().to_string())
-    logger.debug(f'Found {df.shape[0]} products.')
+    logger.debug('\n%s', df.iloc[:, :2].head())
+    logger.debug("Found %s products.", df.shape[0])
     return sorted(df['id'].to_list())
 
 
@@ -99,9 +230,14 @@ def parse_epoch(time_):
     return datetime.datetime.fromtimestamp(time_, tz=datetime.timezone.utc)
 
 
+_clients = dict()
+_clients_lock = threading.Lock()
+
+
 def get_client(cred_file='./cred.yaml'):
     """
-        Returns an authenticated cbpro client.
+        Returns the authenticated cbpro client of this process, shared by all its fetchers. It is created on the first
+        call, with a keep-alive http session pooling up to cfg.FETCH_CONCURRENCY connections.
 
         Credentials file must contain the following lines.
         api_key: XXX
@@ -110,12 +246,38 @@ def get_client(cred_file='./cred.yaml'):
 
     :return: authenticated client.
     """
+    # clients are per process, a forked worker must not reuse the session of its parent.
+    key = (os.getpid(), cred_file)
+    with _clients_lock:
+        if key not in _clients:
+            auth_client = _new_client(cred_file)
+            if auth_client is None:
+                return None
+            _clients[key] = auth_client
+        return _clients[key]
+
+
+def _new_client(cred_file):
+    import cbpro
+    import yaml
+    from requests.adapters import HTTPAdapter
+
+    class TimeoutHTTPAdapter(HTTPAdapter):
+        """
+        cbpro requests have no timeout, a hung connection would block its thread forever.
+        """
+
+        def send(self, request, timeout=None, **kwargs):
+            return super().send(request, timeout=timeout or cfg.FETCH_TIMEOUT, **kwargs)
+
     try:
         logger.debug('Getting an authenticated client.')
         with open(cred_file, 'r') as f:
             cred = yaml.safe_load(f)
         key, b64secret, passphrase = cred['api_key'], cred['api_secret'], cred['passphrase'],
         auth_client = cbpro.AuthenticatedClient(key, b64secret, passphrase)
+        adapter = TimeoutHTTPAdapter(pool_connections=1, pool_maxsize=cfg.FETCH_CONCURRENCY)
+        auth_client.session.mount('https://', adapter)
         return auth_client
     except FileNotFoundError:
         logger.exception('The cred you passed does not exist. Make sure you have a cred file.')
@@ -123,8 +285,25 @@ def get_client(cred_file='./cred.yaml'):
         logger.exception('One of the required keys in the cred file is missing.')
 
 
+@contextmanager
+def request_executor(max_workers, thread_name_prefix):
+    """
+    Thread pool running blocking requests. Its exit does not wait for requests abandoned after a timeout, they finish
+    in the background.
+    """
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+    try:
+        yield executor
+    finally:
+        executor.shutdown(wait=False)
+
+
 def filename_timeseries(product_id):
-    return os.path.join(cfg.PATH_DB_TIMESERIES, product_id) + '.csv'
+    """
+    Location of the product timeseries for the configured storage backend, a file or a directory.
+    """
+    from storage import get_store
+    return get_store().filename(product_id)
 
 
 def dir_history(bot_name): return os.path.join(cfg.PATH_DB_HISTORY, bot_name)
@@ -136,50 +315,60 @@ def filename_history(bot_name, product_id): return os.path.join(dir_history(bot_
 def dir_features(bot_name): return os.path.join(cfg.PATH_DB_FEATURE, bot_name)
 
 
-def filename_features(bot_name, product_id): return os.path.join(cfg.PATH_DB_FEATURE, bot_name, product_id) + '.csv'
+def feature_table(product_id, key=None):
+    """
+    Name of the feature table of a product in the feature store of a bot, one per bot parameter set (see `Bot.key`).
+    """
+    return os.path.join(product_id, key) if key else product_id
+
+
+def filename_features(bot_name, product_id, key=None):
+    return os.path.join(cfg.PATH_DB_FEATURE, bot_name, feature_table(product_id, key))
 
 
 def read_timeseries(product_id='ETH-EUR'):
     """
-    Simple read_csv wrapper returning a df with correct column names and index.
+    Reads a product timeseries from the configured storage backend, returns a df indexed by epoch or None.
     """
-    filename = filename_timeseries(product_id)
-    if os.path.exists(filename):
-        logger.info(f"Reading {filename}")
-        df = pd.read_csv(filename, index_col=0, header=0)
-        df.set_index('epoch', inplace=True)
-        return df
-    logger.info(f"Not found: {filename}")
-    return None
+    from storage import get_store
+    return get_store().read(product_id)
 
 
 def read_history(bot_name='MaBot', product_id='ETH-EUR'):
     """
     Simple read_csv wrapper returning a df with correct column names and index.
     """
+    import pandas as pd
     filename = filename_history(bot_name, product_id)
     if os.path.exists(filename):
-        logger.info(f"Reading {filename}")
+        logger.info("Reading %s", filename)
         df = pd.read_csv(filename, index_col=0, header=0)
         df.rename(columns={'time': 'epoch'}, inplace=True)
         df.set_index('epoch', inplace=True)
         return df
-    logger.info(f"Not found: {filename}")
+    logger.info("Not found: %s", filename)
     return None
 
 
-def read_features(bot_name='MaBot', product_id='ETH-EUR'):
+def read_features(bot_name='MaBot', product_id='ETH-EUR', start=None, stop=None, key=None):
     """
-    Simple read_csv wrapper returning a df with correct column names and index.
+    Reads bot features from the feature store, optionally only those with start <= epoch <= stop.
+    :param key: parameters of the bot, as returned by `Bot.key`.
+    Returns a df indexed by epoch or None.
     """
-    filename = filename_features(bot_name, product_id)
-    if os.path.exists(filename):
-        logger.info(f"Reading {filename}")
-        df = pd.read_csv(filename, index_col=0, header=0, engine='c')
-        # df.set_index('epoch', inplace=True) is already
-        return df
-    logger.info(f"Not found: {filename}")
-    return None
+    from storage import FeatureStore
+    df = FeatureStore().read(bot_name, feature_table(product_id, key), start=start, stop=stop)
+    if df is None:
+        logger.info("Not found: %s", filename_features(bot_name, product_id, key))
+    return df
+
+
+def read_gaps(product_id='ETH-EUR', start=None, stop=None):
+    """
+    Gaps of a product as inclusive (start, stop) epoch ranges of missing candles, from the persisted gap index.
+    """
+    from gaps import get_gap_index
+    return get_gap_index(product_id).query(start, stop)
 
 
 if __name__ == '__main__':
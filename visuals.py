@@ -1,53 +1,67 @@
+import threading
 import dash
-from dash import dcc, html
+from dash import dcc, html, Input, Output
 from plotly.subplots import make_subplots
 import plotly.graph_objects as go
 import utils
 import time
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from base64 import b64encode
+import numpy as np
+import pandas as pd
 import config as cfg
+import metrics
+from downsample import downsample
+from events import CrossoverIndex
+from bots.Bot import MaBot
+from storage import get_store, FeatureStore
 
 color = ['red', 'green', 'blue']
 
 logger = utils.get_logger('visuals')
 
 
-# TODO: Show only first 10, ranked by signal strength.
-# TODO: Add Sell to Buy switches to the graph
-# TODO: Regular updates.
-
-
-def get_data(product):
+def get_data(product, key, bot_name='MaBot'):
     """
     Gets all data of a given product.
-    :param product:
-    :return: 3 df for coin, feature timeseries and rec history.
+    :param key: parameters of the bot, as returned by `Bot.key`.
+    :return: 2 df for coin and feature timeseries (indexed by epoch).
     """
-    bot_name = 'MaBot'
     coin = utils.read_timeseries(product)
-    features = utils.read_features(bot_name, product_id=product)
-    if features is not None:
-        features.index = features.index.map(utils.parse_epoch)
-    history = utils.read_history(bot_name, product_id=product)
-    if history is not None:
-        history.index = history.index.map(utils.parse_epoch)
-    return coin, features, history
+    features = utils.read_features(bot_name, product_id=product, key=key)
+    return coin, features
 
 
-def subplot_traces(product):
-    trace_ = list()
-    start_time = time.time()
-    df, df2, df3 = get_data(product)
-    logger.debug(f"get_data for {product} took: {time.time() - start_time} s")
-    if df3.empty:
-        reco = None
-    else:
-        reco = df3.loc[df3.index == df3.index.max()].values[0][0]  # sell or buy or whatever
+def panel_series(product, df, df2, events, max_points=cfg.DASH_MAX_POINTS) -> dict:
+    """
+    Downsamples the close price and the features of a product to at most max_points each, plus the samples around
+    crossover events, which are kept in every series.
+    :param events: crossover events indexed by epoch.
+    :return: dict of series name to Series indexed by datetime.
+    """
+    columns = {product: (df.index.values, df['close'].values)}
+    if df2 is not None:
+        columns.update({col: (df2.index.values, df2[col].values) for col in df2.columns})
+    series = dict()
+    for name, (epoch, values) in columns.items():
+        at = np.flatnonzero(np.isin(epoch, events.index.values))
+        keep = np.union1d(at[at > 0] - 1, at)
+        i = downsample(epoch, values, max_points, keep=keep, method=cfg.DASH_DOWNSAMPLING)
+        series[name] = pd.Series(values[i], index=pd.to_datetime(epoch[i], unit='s', utc=True), name=name)
+    return series
+
 
+def subplot_traces(product, series: dict, events=None):
+    """
+    Scatter traces of the (downsampled) series of a product, the price first and then the features, and markers of
+    the crossover events on the price.
+    """
+    trace_ = list()
     start_time = time.time()
-    trace_.append(go.Scatter(x=df.datetime,
-                             y=df.close,
+    price = series[product]
+    trace_.append(go.Scatter(x=price.index,
+                             y=price.values,
                              mode='lines',
                              name=product,
                              line=dict(color='black', width=1, ),
@@ -55,16 +69,28 @@ def subplot_traces(product):
                              hoverinfo='none'
                              ))
 
-    for n_line, col in enumerate(df2.columns):
-        trace_.append(go.Scatter(x=df2.index,
-                                 y=df2[col],
+    for n_line, col in enumerate(c for c in series if c != product):
+        trace_.append(go.Scatter(x=series[col].index,
+                                 y=series[col].values,
                                  mode='lines',
                                  name=col,
                                  showlegend=False,
                                  hoverinfo='none',
                                  line=dict(color=color[n_line], width=2, )))
-    logger.debug(f"trace_generation for {product} took: {time.time() - start_time} s")
-    return {reco: trace_}
+
+    if events is not None and not events.empty:
+        x = pd.to_datetime(events.index.values, unit='s', utc=True)
+        trace_.append(go.Scatter(x=x,
+                                 y=price.reindex(x).values,
+                                 mode='markers',
+                                 name='crossover',
+                                 showlegend=False,
+                                 hoverinfo='none',
+                                 marker=dict(symbol=np.where(events['direction'] > 0, 'triangle-up', 'triangle-down'),
+                                             color=np.where(events['direction'] > 0, 'green', 'red'),
+                                             size=8)))
+    logger.debug("trace_generation for %s took: %s s", product, time.time() - start_time)
+    return trace_
 
 
 def get_subplot(sp_traces):
@@ -107,55 +133,206 @@ def get_subplot(sp_traces):
     return panel
 
 
-def tree(): return defaultdict(tree)
+def signal_strength(features: pd.DataFrame, last_crossover=None):
+    """
+    Signal strength of a product from its latest feature rows: the distance between the small and the large moving
+    average relative to the large one, weighted down by the rows since their last crossover (halved if they did not
+    cross within the given rows).
+    :param features: latest feature rows, one column per window length.
+    :param last_crossover: epoch of the last crossover of the averages (see `events.CrossoverIndex`), None if there is
+    none.
+    :return: dict with rec, score, distance and age, None if the averages are not available yet.
+    """
+    windows = sorted(features.columns, key=int)
+    small, large = features[windows[0]].values[-1], features[windows[-1]].values[-1]
+    if np.isnan(small) or np.isnan(large):
+        return None
+    distance = (small - large) / large
+    rows, epochs = len(features), features.index.values
+    if last_crossover is not None and last_crossover >= epochs[0]:
+        age = rows - 1 - int(np.searchsorted(epochs, last_crossover))
+    else:
+        age = rows
+    rec = "Buy" if distance > 0 else "Sell" if distance < 0 else None
+    return {'rec': rec, 'score': abs(distance) / (1 + age / rows), 'distance': distance, 'age': age}
+
+
+def rank_products(products, key, bot_name='MaBot', k=cfg.DASH_TOP_K, rows=cfg.DASH_RANK_ROWS) -> pd.DataFrame:
+    """
+    Ranks products by signal strength, reading only the last rows of their features and the last event of their
+    crossover index.
+    :param key: parameters of the bot, as returned by `Bot.key`.
+    :return: df indexed by product with the k strongest products of each recommendation, strongest first.
+    """
+    store = FeatureStore()
+    scores = dict()
+    for product in products:
+        features = store.tail(bot_name, utils.feature_table(product, key), rows)
+        if features is None or features.empty:
+            continue
+        last = CrossoverIndex(bot_name, product, key).last_event()
+        score = signal_strength(features, last['epoch'] if last is not None else None)
+        if score is not None:
+            scores[product] = score
+    ranking = pd.DataFrame.from_dict(scores, orient='index', columns=['rec', 'score', 'distance', 'age'])
+    return ranking.sort_values('score', ascending=False).groupby('rec', sort=False).head(k)
 
 
-products = utils.list_local_products()
+def product_state(product, key, bot_name='MaBot'):
+    """
+    Cheap change marker of everything a product panel is built from: its timeseries and the bot features.
+    """
+    features = FeatureStore().table(bot_name, utils.feature_table(product, key)).state()
+    return get_store().state(product), features
 
-# First get the sp_traces
-all_traces = tree()
-for row_id, p in enumerate(products):
-    for rec, trace in subplot_traces(p).items():
-        all_traces[str(rec)][p] = trace  # example: panel_trances['Sell']['BTC-EUR'] = trace str conversion ensures
-        # that nans are converted to 'nan'. This is necessary as nan's cannot be used as keys.
 
-# Here one can add selection logic based on importance of coins.
-pass
+def render_image(figure: dict) -> str:
+    """
+    Renders a figure (as a dict, so that it can be sent to a worker process) to a base64 encoded PNG.
+    """
+    img_bytes = go.Figure(figure).to_image(format="png")
+    return "data:image/png;base64," + b64encode(img_bytes).decode()
+
+
+class ProductPanel:
+    """
+    Cached figure of a product, valid as long as the product state does not change.
+    """
+
+    def __init__(self, product, state, figure, series):
+        self.product = product
+        self.state = state
+        self.figure = figure
+        self.series = series
+        self.image = None
+
+
+class Dashboard:
+    """
+    Builds product panels lazily and keeps them cached. A refresh ranks all products by signal strength and rebuilds
+    only the panels of the top ranked products whose files changed since they were built, PNG rendering of the
+    rebuilt panels is done in a process pool.
+    """
+
+    def __init__(self, bot_name='MaBot', window_length=cfg.DASH_WINDOW_LENGTH, workers=cfg.DASH_RENDER_WORKERS):
+        """
+        :param window_length: window lengths (days) of the MaBot shown.
+        """
+        self.bot_name = bot_name
+        self.window_length = window_length
+        self.key = MaBot.key_of(window_length=window_length)
+        self.workers = workers
+        self._panels = dict()
+        self._ranking = rank_products([], self.key, bot_name)
+        self._lock = threading.Lock()
+        self._executor = None
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    def build(self, product, state) -> ProductPanel:
+        start_time = time.time()
+        with metrics.timer('dashboard_build_seconds'):
+            df, df2 = get_data(product, self.key, self.bot_name)
+            logger.debug("get_data for %s took: %s s", product, time.time() - start_time)
+            events = CrossoverIndex(self.bot_name, product, self.key).events()
+            series = panel_series(product, df, df2, events)
+            traces = subplot_traces(product, series, events)
+            figure = get_subplot({product: traces})
+            figure.add_traces(traces, rows=[1] * len(traces), cols=[1] * len(traces))
+        logger.debug("Building the panel of %s took: %s s", product, time.time() - start_time)
+        return ProductPanel(product, state, figure, series)
+
+    def refresh(self):
+        """
+        Rebuilds the panels of new or changed top ranked products and drops those of products that left the ranking.
+        :return: number of rebuilt panels.
+        """
+        with self._lock, metrics.timer('dashboard_refresh_seconds'):
+            start_time = time.time()
+            self._ranking = rank_products(utils.list_local_products(), self.key, self.bot_name)
+            products = list(self._ranking.index)
+            stale = dict()
+            for product in products:
+                state = product_state(product, self.key, self.bot_name)
+                panel = self._panels.get(product)
+                if panel is None or panel.state != state:
+                    stale[product] = state
+            rebuilt = {p: self.build(p, state) for p, state in stale.items()}
+            if cfg.RENDER_OPTION == "image" and rebuilt:
+                with metrics.timer('dashboard_render_seconds'):
+                    futures = {p: self.executor.submit(render_image, panel.figure.to_dict())
+                               for p, panel in rebuilt.items()}
+                    for p, future in futures.items():
+                        rebuilt[p].image = future.result()
+            self._panels = {p: rebuilt.get(p) or self._panels[p] for p in products}
+            metrics.counter('dashboard_panels_rebuilt_total').inc(len(rebuilt))
+            logger.debug("Refreshed %s of %s panels in %s s", len(rebuilt), len(products), time.time() - start_time)
+            return len(rebuilt)
+
+    def panels(self) -> dict:
+        """
+        Up to date panels of the top ranked products grouped by the recommendation of their ranking, strongest first,
+        e.g. panels['Sell']['BTC-EUR'].
+        """
+        self.refresh()
+        grouped = defaultdict(dict)
+        for product, rec in self._ranking['rec'].items():
+            grouped[rec][product] = self._panels[product]
+        return grouped
+
+    def children(self) -> list:
+        return [html.Div([html.H1(rec, style=h1_style), *[to_component(panel) for panel in panels.values()]],
+                         style=div_style) for rec, panels in self.panels().items()]
+
+
+def to_component(panel: ProductPanel):
+    if panel.image is not None:
+        return html.Img(src=panel.image, style=im_style)
+    return dcc.Graph(id=panel.product, figure=panel.figure)
+
+
+_dashboard = None
+
+
+def get_dashboard() -> Dashboard:
+    global _dashboard
+    if _dashboard is None:
+        _dashboard = Dashboard()
+    return _dashboard
 
-# Add the sp_traces to figure
-logger.debug("Adding sp_traces...")
-panels = dict()
-start_time = time.time()
-for rec, subplot_traces in all_traces.items():
-    # generate a panel to contain sp_traces.
-    panels[rec] = get_subplot(subplot_traces)
-    for row_id, (product_id, trace) in enumerate(subplot_traces.items()):
-        n_trace = len(trace)
-        panels[rec].add_traces(trace, rows=[row_id + 1] * n_trace, cols=[1] * n_trace)
-logger.debug(f"trace_appending for took: {time.time() - start_time} s")
 
 app = dash.Dash(__name__)
 h1_style = {'text-align': 'center', 'fontSize': 36, 'fontFamily': "Courier New"}
 div_style = {'float': 'left', 'margin': 'auto', 'width': '33%'}
 im_style = {'float': 'left', 'margin': 'auto', 'width': '600'}
 
-if cfg.RENDER_OPTION == "image":
-    # image rendering
-    def to_image(fig):
-        img_bytes = fig.to_image(format="png")
-        encoding = b64encode(img_bytes).decode()
-        img_b64 = "data:image/png;base64," + encoding
-        return html.Img(src=img_b64, style=im_style)
-    start_time = time.time()
-    app.layout = html.Div([
-        html.Div([html.H1(str(k), style=h1_style), to_image(panels[k])], style=div_style) for k in panels.keys()])
-    logger.debug(f"Final layout generation took: {time.time() - start_time} s")
-else:
-    # vector rendering
-    start_time = time.time()
-    app.layout = html.Div([
-        html.Div([html.H1(str(k), style=h1_style),
-                  html.Div(dcc.Graph(id=k, figure=panels[k]))], style=div_style) for k in panels.keys()])
-    logger.debug(f"Final layout generation took: {time.time() - start_time} s")
+
+def page(children):
+    return html.Div([html.Div(children, id='panels'),
+                     dcc.Interval(id='refresh', interval=cfg.DASH_REFRESH_SECONDS * 1000)])
+
+
+def serve_layout():
+    """
+    Called by dash on every page load, nothing is built before the first request.
+    """
+    return page(get_dashboard().children())
+
+
+# an empty page for callback validation, otherwise dash calls serve_layout when it is assigned.
+app.validation_layout = page([])
+app.layout = serve_layout
+
+
+@app.callback(Output('panels', 'children'), Input('refresh', 'n_intervals'), prevent_initial_call=True)
+def refresh_panels(n_intervals):
+    return get_dashboard().children()
+
+
 if __name__ == "__main__":
+    metrics.start('dashboard')
     app.run_server(debug=False, dev_tools_hot_reload=False)